@@ -7,25 +7,111 @@ Q: Why do we need to create tables in advance? Pandas creates tables automatical
    so that we do not need to care about the schema.
 A: We want to keep the information about primary keys and foreign keys. We use
    such an information to create a diagram of the relation among the tables.
+
+Q: How can we make the nightly rebuild faster?
+A: Use --bulk. The rows are inserted with executemany instead of DataFrame.to_sql
+   and the durability PRAGMAs are relaxed during the load (see LOAD_PRAGMAS).
+
+Q: Can we load the tables in parallel?
+A: Use --jobs N. The CSV files are parsed in N processes and a single connection
+   inserts them in the order of the foreign keys (see lib/loader.py).
+
+Q: Do we have to rebuild the whole database every time?
+A: No. With --incremental only the tables whose MD5 checksum in data/*.txt.dvc
+   has changed since the last load are processed. Their rows are upserted by
+   the primary keys. (Rows removed from a CSV file are kept in the table.)
+
+Q: Where are the indexes on the foreign keys?
+A: They are in sql/data-indexes.sql and are created after the tables are loaded.
+   ANALYZE is executed afterwards. Database.explain_query shows whether a query
+   uses them.
+
+Q: How much memory does the script need?
+A: The CSV files are read and inserted chunk by chunk (--chunksize rows at once),
+   so the memory usage does not depend on the size of the files.
 """
 
-import pandas as pd
+import argparse
+from time import time
 from pathlib import Path
 
 from lib.database import Database
+from lib.loader import load_tables, update_tables, read_dvc_md5, save_checksum
 
 data_dir = Path("data") ## directory for CSV files
 sql_dir = Path("sql") ## directory for SQL files (script, database)
 db_path = sql_dir.joinpath("database.sqlite") ##
 sql_path = sql_dir.joinpath("data-model.sql") ## DDL script
+index_path = sql_dir.joinpath("data-indexes.sql") ## secondary indexes
 
-if __name__ == "__main__":
-    with Database(db_path=db_path, sql_path=sql_path) as db:
-        db.initialize_db()
+read_csv_kwargs = dict(sep="\t", parse_dates=True, encoding="latin_1")
+
+tables = ["Campaigns", "Customers", "Orderlines", "Orders", "Products"]
+csv_paths = {table: data_dir.joinpath("%s.txt" % table.lower()) for table in tables}
+
+
+def full_load(db:Database, args:argparse.Namespace):
+    """
+    drop the tables and load all CSV files
+    """
+    db.initialize_db()
+
+    if args.jobs > 1:
+        start = time()
+        n_rows = load_tables(db, csv_paths, n_jobs=args.jobs, chunksize=args.chunksize,
+                             read_csv_kwargs=read_csv_kwargs)
+        elapsed = time() - start
+        for table, n in n_rows.items():
+            print("------ %s: %d rows" % (table, n))
+        print("%d rows in %0.1f sec" % (sum(n_rows.values()), elapsed))
 
-        tables = ["Campaigns", "Customers", "Orderlines", "Orders", "Products"]
+    else:
         for table in tables:
             print("------ %s" % table)
-            csv_path = data_dir.joinpath("%s.txt" % table.lower())
-            df = pd.read_csv(csv_path, sep="\t", parse_dates=True, encoding="latin_1")
-            db.insert_data(df,table,if_exists="append")
+
+            start = time()
+            n_rows = db.insert_csv(csv_paths[table], table, chunksize=args.chunksize,
+                                   read_csv_kwargs=read_csv_kwargs,
+                                   bulk=args.bulk, if_exists="append")
+            elapsed = time() - start
+            print("%d rows in %0.1f sec (%0.0f rows/sec)" % (n_rows, elapsed, n_rows/max(elapsed, 1e-9)))
+
+    for table in tables:
+        save_checksum(db, table, read_dvc_md5(csv_paths[table].with_suffix(".txt.dvc")))
+
+
+def incremental_load(db:Database, args:argparse.Namespace):
+    """
+    upsert only the tables whose CSV file has changed
+    """
+    db.initialize_db(drop=False)
+
+    start = time()
+    n_rows = update_tables(db, csv_paths, chunksize=args.chunksize,
+                           read_csv_kwargs=read_csv_kwargs)
+    elapsed = time() - start
+    for table in tables:
+        print("------ %s: %s" % (table, "%d rows" % n_rows[table] if table in n_rows else "unchanged"))
+    print("%d rows in %0.1f sec" % (sum(n_rows.values()), elapsed))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the CSV files into the database")
+    parser.add_argument("--chunksize", type=int, default=100000,
+                        help="number of rows to read and insert at once")
+    parser.add_argument("--bulk", action="store_true",
+                        help="insert with executemany under the load-time PRAGMAs")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="number of processes to parse the CSV files in parallel")
+    parser.add_argument("--incremental", action="store_true",
+                        help="upsert only the tables whose DVC checksum has changed")
+    args = parser.parse_args()
+
+    with Database(db_path=db_path, sql_path=sql_path) as db:
+        if args.incremental:
+            incremental_load(db, args)
+        else:
+            full_load(db, args)
+
+        print("------ indexes and ANALYZE")
+        db.create_indexes(index_path)
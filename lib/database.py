@@ -2,24 +2,316 @@
 Helper class to deal with the SQLite3 database
 """
 
+import re
+import glob
+import queue
+import hashlib
+import asyncio
 import sqlite3
-from typing import Union, Callable
+import threading
+import warnings
+from typing import Union, Callable, Iterator, AsyncIterator, Any
 from pathlib import Path
+from contextlib import contextmanager, nullcontext, ExitStack
+from concurrent.futures import ThreadPoolExecutor, Future
 
 import pandas as pd
 
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+## PRAGMAs which are set during a bulk load. They trade the durability
+## for the speed. This is fine because we can always rebuild the database.
+LOAD_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "OFF",
+    "cache_size": -512000, ## negative value means KiB, i.e. 500 MiB
+}
+
+## number of prepared statements kept by a connection. A query which is
+## executed again with the same SQL text (and other parameters) is not parsed
+## and planned again.
+CACHED_STATEMENTS = 256
+
+
+def quote_identifier(name:str) -> str:
+    """
+    quote the name of a table or a column for an SQL statement
+
+    :param name: name of a table or a column
+    :return: quoted name
+    """
+    return '"%s"' % name.replace('"', '""')
+
+
+def quote_table(name:str) -> str:
+    """
+    quote the name of a table which may be qualified by the name of the
+    database (e.g. main.Orders or a table of an attached database)
+
+    :param name: name of a table
+    :return: quoted name
+    """
+    return ".".join(quote_identifier(part) for part in name.split(".", 1))
+
+
+def table_info_sql(table:str) -> str:
+    """
+    :param table: name of a table (may be qualified by the database)
+    :return: PRAGMA statement to get the columns of the table
+    """
+    schema, _, name = table.partition(".") if "." in table else ("", "", table)
+    prefix = quote_identifier(schema) + "." if schema else ""
+    return "PRAGMA %stable_info(%s)" % (prefix, quote_identifier(name))
+
+
+def to_records(data:pd.DataFrame) -> Iterator[tuple]:
+    """
+    convert the DataFrame into tuples of Python objects which sqlite3 accepts.
+    The conversion is done column-wise with NumPy. Missing values become None
+    and datetimes become strings in DATETIME_FORMAT.
+
+    :param data: DataFrame
+    :return: iterator of rows
+    """
+    columns = []
+    for col in data.columns:
+        s = data[col]
+        if pd.api.types.is_datetime64_any_dtype(s):
+            s = s.dt.strftime(DATETIME_FORMAT)
+
+        ## a new array, so that the DataFrame is never modified
+        values = s.to_numpy(dtype=object, copy=True)
+        values[pd.isna(values)] = None
+        columns.append(values.tolist())
+
+    return zip(*columns)
+
+
+def convert_datetime(df:pd.DataFrame, is_datetime:Callable[[str],bool]=None) -> pd.DataFrame:
+    """
+    convert the columns to datetime
+
+    :param df: DataFrame
+    :param is_datetime: function to determin if a column is datetime
+    :return: the same DataFrame
+    """
+    if is_datetime is not None:
+        for col in [col for col in df.columns if is_datetime(col)]:
+            df[col] = pd.to_datetime(df[col])
+
+    return df
+
+
+def read_schema(connection:sqlite3.Connection, table:str) -> dict:
+    """
+    :param connection: connection to the database
+    :param table: name of the table
+    :return: dict column -> declared type in the DDL (upper case)
+    """
+    rows = connection.execute(table_info_sql(table)).fetchall()
+    return {row[1]: row[2].upper() for row in rows}
+
+
+def apply_schema(df:pd.DataFrame, schema:dict, datetime_format:str=DATETIME_FORMAT,
+                 max_category_rate:float=0.5) -> pd.DataFrame:
+    """
+    convert the columns according to the declared types in the DDL
+
+    - DATETIME: datetime64 parsed with the fixed format
+    - TEXT: category if the number of distinct values is at most
+            max_category_rate * (number of rows)
+    - INTEGER: the smallest integer type (if there is no missing value)
+
+    :param df: DataFrame
+    :param schema: dict column -> declared type (see Database.get_schema)
+    :param datetime_format: format of the DATETIME columns
+    :param max_category_rate: threshold for a TEXT column to be category
+    :return: the same DataFrame
+    """
+    for col, declared_type in schema.items():
+        if col not in df.columns:
+            continue
+
+        s = df[col]
+        if declared_type in ("DATETIME", "DATE", "TIMESTAMP"):
+            try:
+                df[col] = pd.to_datetime(s, format=datetime_format)
+            except (ValueError, TypeError):
+                df[col] = pd.to_datetime(s)
+
+        elif declared_type == "TEXT":
+            if len(s) > 0 and s.nunique() <= max_category_rate * len(s):
+                df[col] = s.astype("category")
+
+        elif declared_type == "INTEGER":
+            if pd.api.types.is_integer_dtype(s):
+                df[col] = pd.to_numeric(s, downcast="integer")
+
+    return df
+
+
+class ConnectionPool:
+    def __init__(self, db_path:Union[Path,str], size:int=4, timeout:float=None,
+                 cached_statements:int=CACHED_STATEMENTS):
+        """
+        thread-safe pool of read-only connections to the database file.
+        A connection is opened when it is needed for the first time and
+        at most size connections are opened.
+
+        :param db_path: path to the database file
+        :param size: maximum number of connections
+        :param timeout: seconds to wait for a free connection (default: forever)
+        :param cached_statements: number of prepared statements cached by each connection
+        """
+        if size < 1:
+            raise ValueError("size must be positive")
+
+        self.uri = "%s?mode=ro" % Path(db_path).resolve().as_uri()
+        self.size = size
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+
+        self._idle = queue.LifoQueue()
+        self._n_connections = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+
+    def _checkout(self) -> sqlite3.Connection:
+        if self._closed:
+            raise ValueError("The connection pool is closed")
+
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._n_connections < self.size
+            if can_open:
+                self._n_connections += 1
+
+        if can_open:
+            try:
+                return sqlite3.connect(self.uri, uri=True, check_same_thread=False,
+                                       cached_statements=self.cached_statements)
+            except Exception:
+                with self._lock:
+                    self._n_connections -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError("No connection is returned to the pool in %s sec" % self.timeout)
+
+
+    def _checkin(self, connection:sqlite3.Connection):
+        if connection.in_transaction:
+            connection.rollback()
+
+        if self._closed:
+            connection.close()
+        else:
+            self._idle.put(connection)
+
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        context manager to check out a connection. The connection is returned
+        to the pool at the end, so do not close it.
+
+            with pool.connection() as connection:
+                df = pd.read_sql(query, connection)
+        """
+        connection = self._checkout()
+        try:
+            yield connection
+        finally:
+            self._checkin(connection)
+
+
+    def close(self):
+        """
+        close the idle connections. The checked-out ones are closed when they
+        are returned.
+        """
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
 class Database:
-    def __init__(self, db_path:Union[Path,str]=None, sql_path:Union[Path,str]=None):
+    def __init__(self, db_path:Union[Path,str]=None, sql_path:Union[Path,str]=None,
+                 cache_dir:Union[Path,str]=None, pool_size:int=0, wal:bool=False,
+                 cached_statements:int=CACHED_STATEMENTS):
+        """
+        :param db_path: path to the database file (default: in-memory database)
+        :param sql_path: path to the DDL script
+        :param cache_dir: directory for the Feather files of read_table. If it is
+                          given, a table is read from SQLite only once for each
+                          version of the database file. (requires pyarrow)
+        :param pool_size: if positive, read_query, read_table and iter_query use a
+                          pool of pool_size read-only connections, so that they can
+                          be called from several threads at once. self.connection
+                          stays the only writer and belongs to the thread which
+                          creates the instance. The readers see only the committed
+                          rows. Use wal=True, so that the readers do not block the
+                          writer.
+        :param wal: switch the database file to WAL mode. This is persistent:
+                    the file stays in WAL mode for every other program using it,
+                    and a "-wal" file appears next to it.
+        :param cached_statements: number of prepared statements cached by each
+                                  connection (see read_query)
+        """
         self.db_path: Union[str,Path] = ":memory:" if db_path is None else Path(db_path)
         self.sql_path = None if sql_path is None else Path(sql_path)
 
-        self.connection = sqlite3.connect(str(self.db_path))
+        if cache_dir is not None and db_path is None:
+            raise ValueError("cache_dir can not be used with the in-memory database")
+        self.cache_dir = None if cache_dir is None else Path(cache_dir)
+
+        self.connection = sqlite3.connect(str(self.db_path), cached_statements=cached_statements)
         self.cursor = self.connection.cursor()
+        self._load_depth = 0 ## > 0 while load_pragmas is active
+
+        if wal:
+            if db_path is None:
+                raise ValueError("wal can not be used with the in-memory database")
+            self.cursor.execute("PRAGMA journal_mode = WAL").fetchone()
+
+        self.pool = None
+        if pool_size > 0:
+            if db_path is None:
+                raise ValueError("pool_size can not be used with the in-memory database")
+            self.pool = ConnectionPool(self.db_path, size=pool_size,
+                                       cached_statements=cached_statements)
+
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """
+        context manager to check out a connection for reading:
+        a pooled read-only connection if pool_size is given, otherwise
+        the connection of the instance.
+        """
+        if self.pool is None:
+            yield self.connection
+        else:
+            with self.pool.connection() as connection:
+                yield connection
 
 
-    def initialize_db(self):
+    def initialize_db(self, drop:bool=True):
         """
         Prepare the database file and tables
+
+        :param drop: if False, the DROP TABLE statements in the DDL are skipped,
+                     so that the existing tables and their rows are kept.
         """
         if self.sql_path is None:
             raise ValueError("sql_path is not given at the instantiation")
@@ -27,17 +319,91 @@ class Database:
         with self.sql_path.open("r") as ddl_file:
             sql_statement = "\n".join(ddl_file.readlines())
 
+        if not drop:
+            sql_statement = re.sub(r"DROP\s+TABLE[^;]*;", "", sql_statement, flags=re.IGNORECASE)
+
         try:
             self.cursor.executescript(sql_statement)
             self.connection.commit()
+            self.clear_cache()
         except Exception as e:
             print("-- following sql statement is not executed")
             self.connection.rollback()
             raise Exception(e)
 
 
+    def create_indexes(self, index_path:Union[Path,str]):
+        """
+        execute the script with CREATE INDEX statements and update the
+        statistics for the query planner (ANALYZE). This should be done
+        after the bulk load.
+
+        :param index_path: path to the SQL script
+        """
+        with Path(index_path).open("r") as index_file:
+            sql_statement = index_file.read()
+
+        self.connection.commit()
+        self.cursor.executescript(sql_statement)
+        self.cursor.execute("ANALYZE")
+        self.connection.commit()
+
+
+    def explain_query(self, query:str, params=None) -> pd.DataFrame:
+        """
+        show the query plan. A line such as "SCAN Orders" means a full scan
+        while "SEARCH Orders USING INDEX ..." means that an index is used.
+
+        :param query: sql query
+        :param params: parameters of the query (for "?" placeholders)
+        :return: DataFrame of the query plan (column "detail")
+        """
+        return self.read_query("EXPLAIN QUERY PLAN %s" % query, params=params)
+
+
+    @contextmanager
+    def load_pragmas(self, pragmas:dict=None):
+        """
+        context manager which sets the PRAGMAs for a bulk load and restores
+        the previous values at the end. Nested calls do nothing.
+
+        :param pragmas: dict of PRAGMAs to set (default: LOAD_PRAGMAS)
+        """
+        if self._load_depth > 0:
+            yield self
+            return
+
+        pragmas = LOAD_PRAGMAS if pragmas is None else pragmas
+
+        ## journal_mode can not be changed in a transaction
+        self.connection.commit()
+        previous = {k: self.cursor.execute("PRAGMA %s" % k).fetchone()[0]
+                    for k in pragmas.keys()}
+
+        self._load_depth += 1
+        try:
+            for k, v in pragmas.items():
+                self.cursor.execute("PRAGMA %s = %s" % (k, v))
+            yield self
+        finally:
+            self._load_depth -= 1
+            self.connection.commit()
+            for k, v in previous.items():
+                self.cursor.execute("PRAGMA %s = %s" % (k, v))
+
+
+    def get_primary_key(self, table:str) -> list:
+        """
+        :param table: name of the table
+        :return: list of the columns of the primary key
+        """
+        rows = self.cursor.execute(table_info_sql(table)).fetchall()
+        ## (cid, name, type, notnull, dflt_value, pk) where pk is the position in the key
+        return [row[1] for row in sorted(rows, key=lambda row: row[5]) if row[5] > 0]
+
+
     def insert_data(self, data:pd.DataFrame, table:str, if_exists:str="append",
-                    index:bool=False, **kwargs):
+                    index:bool=False, bulk:bool=False, upsert:bool=False, **kwargs):
         """
         insert the given DataFrame into the tabel in DB
 
@@ -45,49 +411,444 @@ class Database:
         :param table: name of the table
         :param if_exists: "append" (default), "fail" or "replace" same as if_exists in DataFrame.to_sql
         :param index: same as index in DataFrame.to_sql
+        :param bulk: insert the rows with executemany in one transaction under
+                     LOAD_PRAGMAS instead of DataFrame.to_sql. The table must exist.
+        :param upsert: update the existing rows with the same primary key instead of
+                       failing. Rows which do not change are not written. (implies bulk)
         :param kwargs: passed to DataFrame.to_sql
         """
-        data.to_sql(table, self.connection, if_exists=if_exists, index=index, **kwargs)
+        if not (bulk or upsert):
+            data.to_sql(table, self.connection, if_exists=if_exists, index=index, **kwargs)
+            return
+
+        if if_exists != "append":
+            raise ValueError("bulk insert supports only if_exists='append'")
+
+        if index:
+            data = data.reset_index()
+
+        columns = [quote_identifier(str(col)) for col in data.columns]
+        sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+            quote_table(table), ", ".join(columns), ", ".join("?" * data.shape[1])
+        )
+
+        if upsert:
+            keys = [quote_identifier(col) for col in self.get_primary_key(table)]
+            if not keys:
+                raise ValueError("Table %s has no primary key" % table)
+
+            ## identifiers are case-insensitive in SQLite (e.g. itemID and itemId)
+            key_names = {key.lower() for key in keys}
+            values = [col for col in columns if col.lower() not in key_names]
+            if values:
+                sql += " ON CONFLICT(%s) DO UPDATE SET %s WHERE %s" % (
+                    ", ".join(keys),
+                    ", ".join("%s = excluded.%s" % (col, col) for col in values),
+                    " OR ".join("%s IS NOT excluded.%s" % (col, col) for col in values)
+                )
+            else:
+                sql += " ON CONFLICT(%s) DO NOTHING" % ", ".join(keys)
+
+        with self.load_pragmas():
+            try:
+                if not self.connection.in_transaction:
+                    self.cursor.execute("BEGIN")
+                self.cursor.executemany(sql, to_records(data))
+                self.connection.commit()
+            except Exception:
+                self.connection.rollback()
+                raise
+
+
+    def insert_csv(self, csv_path:Union[Path,str], table:str, chunksize:int=100000,
+                   read_csv_kwargs:dict=None, bulk:bool=False, **kwargs) -> int:
+        """
+        insert a CSV file into the table chunk by chunk. Only one chunk is
+        kept in memory and each chunk is inserted in its own transaction.
+
+        :param csv_path: path to the CSV file
+        :param table: name of the table
+        :param chunksize: number of rows to read and insert at once
+        :param read_csv_kwargs: passed to pandas.read_csv
+        :param bulk: see insert_data. The PRAGMAs are kept during the whole file.
+        :param kwargs: passed to insert_data
+        :return: number of inserted rows
+        """
+        read_csv_kwargs = {} if read_csv_kwargs is None else read_csv_kwargs
+
+        n_rows = 0
+        with self.load_pragmas() if bulk else nullcontext():
+            for chunk in pd.read_csv(csv_path, chunksize=chunksize, **read_csv_kwargs):
+                self.insert_data(chunk, table, bulk=bulk, **kwargs)
+                n_rows += chunk.shape[0]
 
+        return n_rows
 
-    def read_query(self, query:str, **kwargs):
+
+    def read_query(self, query:str, params=None, **kwargs):
         """
         execute the given query and return the result as a DataFrame
 
+        Give the values by params instead of formatting them into the query.
+        Then the SQL text does not change, so that the prepared statement is
+        reused (see cached_statements) and the values are never parsed as SQL.
+
+            db.read_query("SELECT * FROM Orderlines WHERE orderId = ?", params=[order_id])
+
         :param query: sql query to execute
+        :param params: parameters of the query (list for "?" placeholders
+                       or dict for ":name" placeholders)
         :param kwargs: passed to pandas.read_sql
         :return: DataFrame
         """
-        return pd.read_sql(query, self.connection, **kwargs)
+        with self.reader() as connection:
+            return pd.read_sql(query, connection, params=params, **kwargs)
 
 
     def read_table(self, table:str, is_datetime:Callable[[str],bool]=None,
+                   typed:bool=False, datetime_format:str=DATETIME_FORMAT,
                    **kwargs) -> pd.DataFrame:
         """
         read the whole table from the DB and return it as a DataFrame
 
+        The table is cached in cache_dir if it is given at the instantiation
+        and no kwargs are given. The cache is invalidated when the database
+        file is modified.
+
         :param table: name of the table
         :param is_datetime: function to determin if a column is datetime
+        :param typed: convert the columns according to the DDL (see apply_schema)
+        :param datetime_format: format of the DATETIME columns (used if typed)
         :param kwargs: passed to pandas.read_sql
         :return: DataFrame
         """
-        sql = "SELECT * FROM %s" % table
-        df = self.read_query(sql, **kwargs)
+        if self.cache_dir is not None and not kwargs:
+            df = self._read_cached_table(table)
+        else:
+            sql = "SELECT * FROM %s" % quote_table(table)
+            df = self.read_query(sql, **kwargs)
+
+        if typed:
+            df = apply_schema(df, self.get_schema(table), datetime_format=datetime_format)
+
+        return convert_datetime(df, is_datetime)
+
+
+    def get_schema(self, table:str) -> dict:
+        """
+        :param table: name of the table
+        :return: dict column -> declared type in the DDL (upper case)
+        """
+        return read_schema(self.connection, table)
+
+
+    def _cache_prefix(self) -> str:
+        """
+        The database file (its name and a hash of its path), so that databases
+        sharing one cache_dir never read or remove the files of each other.
+        """
+        path_hash = hashlib.md5(str(self.db_path.resolve()).encode("utf-8")).hexdigest()[:12]
+        return "%s-%s" % (self.db_path.name, path_hash)
+
+
+    def _cache_path(self, table:str) -> Path:
+        """
+        The name of the cache file contains the database file, the table and
+        the modification time and the size of the database file and its WAL
+        file, so that a file for an old version of the database is never read.
+        """
+        versions = []
+        for path in [self.db_path, self.db_path.with_name(self.db_path.name + "-wal")]:
+            if path.exists():
+                stat = path.stat()
+                versions.append("%d-%d" % (stat.st_mtime_ns, stat.st_size))
+
+        return self.cache_dir.joinpath("%s.%s.%s.feather" % (self._cache_prefix(), table, "_".join(versions)))
+
 
-        if is_datetime is not None:
-            for col in [col for col in df.columns if is_datetime(col)]:
-                df[col] = pd.to_datetime(df[col])
+    def _read_cached_table(self, table:str) -> pd.DataFrame:
+        try:
+            import pyarrow.feather as feather
+        except ImportError:
+            raise ImportError("pyarrow is required for cache_dir")
+
+        ## uncommitted changes are not visible in the file
+        self.connection.commit()
+        cache_path = self._cache_path(table)
+
+        if cache_path.exists():
+            return feather.read_table(str(cache_path), memory_map=True).to_pandas()
+
+        df = self.read_query("SELECT * FROM %s" % quote_table(table))
+
+        self.clear_cache(table)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(".tmp")
+        try:
+            feather.write_feather(df, str(tmp_path))
+            tmp_path.replace(cache_path)
+        except Exception as e:
+            ## e.g. a column with mixed types
+            tmp_path.unlink(missing_ok=True)
+            warnings.warn("Table %s is not cached: %s" % (table, e))
 
         return df
 
 
+    def clear_cache(self, table:str=None):
+        """
+        remove the cache files of this database
+
+        :param table: name of the table (default: all tables)
+        """
+        if self.cache_dir is None or not self.cache_dir.exists():
+            return
+
+        prefix = glob.escape(self._cache_prefix())
+        pattern = "%s.*.feather" % prefix if table is None else "%s.%s.*.feather" % (prefix, glob.escape(table))
+        for path in self.cache_dir.glob(pattern):
+            path.unlink()
+
+
+    def iter_query(self, query:str, chunksize:int=100000, params=None,
+                   is_datetime:Callable[[str],bool]=None, **kwargs) -> Iterator[pd.DataFrame]:
+        """
+        execute the given query and yield the result chunk by chunk,
+        so that the whole result is never kept in memory.
+
+        :param query: sql query to execute
+        :param chunksize: number of rows of a chunk
+        :param params: parameters of the query (for "?" placeholders)
+        :param is_datetime: function to determin if a column is datetime
+        :param kwargs: passed to pandas.read_sql
+        :return: iterator of DataFrames
+        """
+        with self.reader() as connection:
+            for df in pd.read_sql(query, connection, params=params,
+                                  chunksize=chunksize, **kwargs):
+                yield convert_datetime(df, is_datetime)
+
+
+    def iter_table(self, table:str, chunksize:int=100000, columns:list=None,
+                   where:str=None, params=None, is_datetime:Callable[[str],bool]=None,
+                   **kwargs) -> Iterator[pd.DataFrame]:
+        """
+        read the table chunk by chunk. The projection and the filter
+        are executed in SQLite.
+
+        Example: per-customer aggregate without loading the whole table
+
+            sums = [df.groupby("customerId")["totalPrice"].sum()
+                    for df in db.iter_table("Orders", columns=["customerId", "totalPrice"],
+                                            where="orderDate >= ?", params=["2015-01-01"])]
+            s = pd.concat(sums).groupby(level=0).sum()
+
+        :param table: name of the table
+        :param chunksize: number of rows of a chunk
+        :param columns: list of columns to read (default: all columns)
+        :param where: condition of the WHERE clause (can contain "?" placeholders)
+        :param params: parameters for the placeholders in where
+        :param is_datetime: function to determin if a column is datetime
+        :param kwargs: passed to pandas.read_sql
+        :return: iterator of DataFrames
+        """
+        sql = "SELECT %s FROM %s" % (
+            "*" if columns is None else ", ".join(quote_identifier(col) for col in columns),
+            quote_table(table)
+        )
+        if where is not None:
+            sql += " WHERE %s" % where
+
+        return self.iter_query(sql, chunksize=chunksize, params=params,
+                               is_datetime=is_datetime, **kwargs)
+
+
     def __enter__(self):
         return self
 
 
     def close(self):
+        if self.pool is not None:
+            self.pool.close()
         self.connection.close()
 
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
+
+
+class _Checkout:
+    def __init__(self, adb:"AsyncDatabase"):
+        """
+        async context manager which checks out a pooled connection for
+        AsyncDatabase and runs blocking functions with it on the executor.
+        If the awaiting task is cancelled, a queued call is cancelled and
+        a running statement is interrupted.
+        The connection is returned to the pool after the function stops.
+        """
+        self.adb = adb
+        self.connection = None
+        self.future: Future = None
+        self._stack = ExitStack()
+        self._lock = threading.Lock()
+        self._closed = False
+
+
+    async def __aenter__(self) -> "_Checkout":
+        ## wait in the event loop, so that no worker thread blocks on the pool
+        await self.adb._semaphore.acquire()
+        self._loop = asyncio.get_running_loop()
+        try:
+            self.connection = self._stack.enter_context(self.adb.db.reader())
+        except BaseException:
+            self.adb._semaphore.release()
+            raise
+        return self
+
+
+    async def call(self, func:Callable, *args) -> Any:
+        self.future = self.adb.executor.submit(func, self.connection, *args)
+        try:
+            return await asyncio.wrap_future(self.future)
+        except asyncio.CancelledError:
+            ## a queued call never starts and a running statement is interrupted
+            if not self.future.cancel():
+                with self._lock:
+                    if not self._closed:
+                        self.connection.interrupt()
+            raise
+
+
+    def _close(self, _=None):
+        with self._lock:
+            self._closed = True
+            self._stack.close()
+        self._loop.call_soon_threadsafe(self.adb._semaphore.release)
+
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self.future is not None and not self.future.done():
+            self.future.add_done_callback(self._close)
+        else:
+            self._close()
+
+
+class AsyncDatabase:
+    def __init__(self, db_path:Union[Path,str], max_workers:int=4, wal:bool=False):
+        """
+        asyncio counterpart of Database for reading. The queries run on a
+        bounded thread pool with pooled read-only connections (see
+        Database.pool_size), so that the event loop is never blocked and at
+        most max_workers queries run at once. The other calls wait in the
+        event loop. Cancelling a call (e.g. by asyncio.wait_for) interrupts
+        the running statement.
+
+        The journal mode of the database file is not changed unless wal=True.
+        Without WAL mode a running query blocks a writer in another process
+        (e.g. a reload of the tables) and vice versa.
+
+            async with AsyncDatabase("sql/database.sqlite") as adb:
+                df = await adb.read_query("SELECT * FROM Orderlines WHERE orderId = ?",
+                                          params=[order_id])
+
+        :param db_path: path to the database file
+        :param max_workers: number of threads and connections
+        :param wal: switch the database file to WAL mode (see Database)
+        """
+        self.db = Database(db_path=db_path, pool_size=max_workers, wal=wal)
+        self.executor = ThreadPoolExecutor(max_workers)
+        self._semaphore = asyncio.Semaphore(max_workers)
+
+
+    async def read_query(self, query:str, params=None, **kwargs) -> pd.DataFrame:
+        """
+        execute the given query and return the result as a DataFrame
+
+        :param query: sql query to execute
+        :param params: parameters of the query (for "?" placeholders)
+        :param kwargs: passed to pandas.read_sql
+        :return: DataFrame
+        """
+        async with _Checkout(self) as checkout:
+            return await checkout.call(
+                lambda connection: pd.read_sql(query, connection, params=params, **kwargs))
+
+
+    async def read_table(self, table:str, is_datetime:Callable[[str],bool]=None,
+                         typed:bool=False, datetime_format:str=DATETIME_FORMAT,
+                         **kwargs) -> pd.DataFrame:
+        """
+        read the whole table. The arguments are the same as Database.read_table.
+        """
+        def read(connection:sqlite3.Connection) -> pd.DataFrame:
+            df = pd.read_sql("SELECT * FROM %s" % quote_table(table), connection, **kwargs)
+            if typed:
+                df = apply_schema(df, read_schema(connection, table), datetime_format=datetime_format)
+            return convert_datetime(df, is_datetime)
+
+        async with _Checkout(self) as checkout:
+            return await checkout.call(read)
+
+
+    async def iter_query(self, query:str, chunksize:int=100000, params=None,
+                         is_datetime:Callable[[str],bool]=None,
+                         **kwargs) -> AsyncIterator[pd.DataFrame]:
+        """
+        execute the given query and yield the result chunk by chunk.
+        The next chunk is read only when it is requested, so that a slow
+        consumer does not accumulate chunks. Leaving the loop stops the scan.
+
+            async for df in adb.iter_query("SELECT * FROM Orders", chunksize=10000):
+                ...
+
+        :param query: sql query to execute
+        :param chunksize: number of rows of a chunk
+        :param params: parameters of the query (for "?" placeholders)
+        :param is_datetime: function to determin if a column is datetime
+        :param kwargs: passed to pandas.read_sql
+        :return: async iterator of DataFrames
+        """
+        def start(connection:sqlite3.Connection) -> Iterator[pd.DataFrame]:
+            return iter(pd.read_sql(query, connection, params=params,
+                                    chunksize=chunksize, **kwargs))
+
+        def fetch(connection:sqlite3.Connection, chunks:Iterator[pd.DataFrame]) -> pd.DataFrame:
+            df = next(chunks, None)
+            return None if df is None else convert_datetime(df, is_datetime)
+
+        async with _Checkout(self) as checkout:
+            chunks = await checkout.call(start)
+            try:
+                while True:
+                    df = await checkout.call(fetch, chunks)
+                    if df is None:
+                        break
+                    yield df
+            finally:
+                ## the cursor is closed in the worker thread
+                if checkout.future.done():
+                    chunks.close()
+                else:
+                    checkout.future.add_done_callback(lambda _: chunks.close())
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def close(self):
+        """
+        cancel the queued queries, wait for the running ones and close the
+        connections. The waiting is done in a worker thread, so that the
+        event loop is not blocked.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, lambda: self.executor.shutdown(wait=True, cancel_futures=True))
+
+        ## all connections are idle now. The writer connection belongs to
+        ## this thread, so it must be closed here.
+        self.db.close()
+
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
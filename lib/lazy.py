@@ -0,0 +1,39 @@
+"""
+Deferred imports of heavy modules (plotting, scipy, ...)
+
+A batch job which does not plot anything should not pay the import of
+matplotlib or seaborn. A LazyModule imports the module when one of its
+attributes is accessed for the first time:
+
+    plt = LazyModule("matplotlib.pyplot")
+    ...
+    plt.show() ## matplotlib.pyplot is imported here
+"""
+
+import importlib
+from types import ModuleType
+
+
+class LazyModule:
+    def __init__(self, name:str):
+        """
+        :param name: absolute name of the module (e.g. "scipy.stats")
+        """
+        self._name = name
+        self._module = None
+
+
+    def _load(self) -> ModuleType:
+        if self._module is None:
+            ## import_module holds the import lock, so this is thread-safe
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+
+    def __getattr__(self, attr:str):
+        return getattr(self._load(), attr)
+
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return "<LazyModule %s (%s)>" % (self._name, state)
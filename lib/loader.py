@@ -0,0 +1,263 @@
+"""
+Parallel loader of the CSV files into the SQLite3 database
+
+The CSV files are parsed in a process pool. The parsed chunks are spilled to
+pickle files and their paths are sent through queues to the single writer
+(the given Database) which inserts the tables in the order of the foreign
+keys declared in the DDL. Since a worker never waits for the writer, all
+files are parsed in parallel with the insertion and the wall-clock time is
+about max(parsing time of the largest file, total insertion time).
+
+For the incremental load the MD5 checksums in the DVC files (data/*.txt.dvc)
+are compared with the ones stored in the LoadState table. Only the tables
+whose CSV file has changed are upserted by their primary keys.
+"""
+
+import re
+from queue import Empty
+from datetime import datetime
+from typing import Union, Dict, List, Set
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+
+import pandas as pd
+
+from lib.database import Database, DATETIME_FORMAT
+
+CREATE_TABLE = re.compile(r"CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)\s*\((.*?)\)\s*;",
+                          re.IGNORECASE | re.DOTALL)
+REFERENCES = re.compile(r"REFERENCES\s+(\w+)", re.IGNORECASE)
+DVC_OUT_MD5 = re.compile(r"^outs:.*?\bmd5:\s*(\w+)", re.MULTILINE | re.DOTALL)
+
+LOAD_STATE_TABLE = "LoadState"
+
+## seconds to wait for a chunk before checking if the worker is still alive
+POLL_INTERVAL = 1.0
+
+
+def read_dependencies(sql_path:Union[Path,str]) -> Dict[str,Set[str]]:
+    """
+    read the DDL and find the tables referenced by foreign keys
+
+    :param sql_path: path to the DDL script
+    :return: dict table -> set of tables which the table refers to
+    """
+    with Path(sql_path).open("r") as ddl_file:
+        ddl = ddl_file.read()
+
+    return {table: set(REFERENCES.findall(body)) - {table}
+            for table, body in CREATE_TABLE.findall(ddl)}
+
+
+def load_order(tables:List[str], dependencies:Dict[str,Set[str]]) -> List[str]:
+    """
+    sort the tables so that a referenced table comes before the referencing
+    one. The given order is kept as far as possible.
+
+    :param tables: tables to load
+    :param dependencies: output of read_dependencies
+    :return: sorted list of tables
+    """
+    order = []
+    remaining = list(tables)
+
+    while remaining:
+        ready = [t for t in remaining
+                 if not (dependencies.get(t, set()) & set(remaining))]
+        if not ready:
+            raise ValueError("Circular foreign keys among %s" % ", ".join(remaining))
+
+        order.append(ready[0])
+        remaining.remove(ready[0])
+
+    return order
+
+
+def _parse_csv(csv_path:Path, table:str, spill_dir:Path, queue, chunksize:int,
+               read_csv_kwargs:dict) -> int:
+    """
+    parse the CSV file in a worker process, write each chunk to a pickle file
+    in spill_dir and put its path in the queue. None is put at the end, even
+    if the parsing fails.
+    """
+    n_rows = 0
+    try:
+        for i, chunk in enumerate(pd.read_csv(csv_path, chunksize=chunksize, **read_csv_kwargs)):
+            chunk_path = spill_dir.joinpath("%s.%d.pkl" % (table, i))
+            chunk.to_pickle(chunk_path)
+            queue.put(str(chunk_path))
+            n_rows += chunk.shape[0]
+    finally:
+        queue.put(None)
+
+    return n_rows
+
+
+def _next_chunk(chunk_queue, future) -> Union[str,None]:
+    """
+    get the next path from the queue of a worker. If the worker has stopped
+    without putting None (e.g. it was killed by the OOM killer), its exception
+    is raised instead of waiting forever.
+    """
+    while True:
+        try:
+            return chunk_queue.get(timeout=POLL_INTERVAL)
+        except Empty:
+            if not future.done():
+                continue
+
+        ## everything the worker has put is in the queue now
+        try:
+            return chunk_queue.get_nowait()
+        except Empty:
+            future.result() ## e.g. BrokenProcessPool
+            raise RuntimeError("The worker stopped without finishing the queue")
+
+
+def load_tables(db:Database, csv_paths:Dict[str,Union[Path,str]],
+                sql_path:Union[Path,str]=None, n_jobs:int=None,
+                chunksize:int=100000, spill_dir:Union[Path,str]=None,
+                read_csv_kwargs:dict=None) -> Dict[str,int]:
+    """
+    load the CSV files into the tables. The files are parsed in parallel
+    and the chunks are inserted by the single connection of db.
+
+    The memory holds only the chunks being parsed and the one being inserted.
+    The parsed chunks which are not inserted yet are kept in spill_dir, so it
+    needs up to about the size of the parsed data (e.g. Orderlines while the
+    other tables are inserted). A chunk file is removed after its insertion.
+
+    :param db: Database to write (the tables must exist)
+    :param csv_paths: dict table -> path to the CSV file
+    :param sql_path: DDL to read the foreign keys from (default: db.sql_path)
+    :param n_jobs: number of processes to parse the files (default: number of CPUs)
+    :param chunksize: number of rows of a chunk
+    :param spill_dir: directory for the parsed chunks (default: a temporary
+                      directory, which may be in memory on some systems)
+    :param read_csv_kwargs: passed to pandas.read_csv
+    :return: dict table -> number of inserted rows
+    """
+    sql_path = db.sql_path if sql_path is None else sql_path
+    if sql_path is None:
+        raise ValueError("sql_path is not given")
+
+    read_csv_kwargs = {} if read_csv_kwargs is None else read_csv_kwargs
+    order = load_order(list(csv_paths.keys()), read_dependencies(sql_path))
+
+    n_rows = {}
+
+    ## The manager is shut down before the pool and the pool before the
+    ## temporary directory is removed.
+    with TemporaryDirectory(dir=spill_dir) as tmp_dir, \
+            ProcessPoolExecutor(n_jobs) as executor, Manager() as manager:
+        ## only the paths of the chunk files go through the queues
+        queues = {table: manager.Queue() for table in order}
+
+        ## The tasks are started in the load order, so that the table
+        ## the writer is waiting for has always a worker.
+        futures = {table: executor.submit(_parse_csv, Path(csv_paths[table]), table, Path(tmp_dir),
+                                          queues[table], chunksize, read_csv_kwargs)
+                   for table in order}
+
+        try:
+            with db.load_pragmas():
+                for table in order:
+                    n_rows[table] = 0
+                    while True:
+                        chunk_path = _next_chunk(queues[table], futures[table])
+                        if chunk_path is None:
+                            break
+                        chunk = pd.read_pickle(chunk_path)
+                        Path(chunk_path).unlink()
+                        db.insert_data(chunk, table, bulk=True)
+                        n_rows[table] += chunk.shape[0]
+
+                    ## raise the exception in the worker if any
+                    futures[table].result()
+
+        except BaseException:
+            ## the tasks which have not started yet are not needed any more
+            for future in futures.values():
+                future.cancel()
+            raise
+
+    return n_rows
+
+
+def read_dvc_md5(dvc_path:Union[Path,str]) -> str:
+    """
+    read the MD5 checksum of the tracked file from a DVC file
+
+    :param dvc_path: path to the DVC file (e.g. data/orders.txt.dvc)
+    :return: MD5 checksum
+    """
+    with Path(dvc_path).open("r") as dvc_file:
+        match = DVC_OUT_MD5.search(dvc_file.read())
+
+    if match is None:
+        raise ValueError("No md5 of outs is found in %s" % dvc_path)
+
+    return match.group(1)
+
+
+def read_checksums(db:Database) -> Dict[str,str]:
+    """
+    :param db: Database
+    :return: dict table -> MD5 checksum of the CSV file loaded last time
+    """
+    sql = "SELECT tableName, md5 FROM %s" % LOAD_STATE_TABLE
+    return dict(db.cursor.execute(sql).fetchall())
+
+
+def save_checksum(db:Database, table:str, md5:str):
+    """
+    store the MD5 checksum of the CSV file which has been loaded into the table
+
+    :param db: Database
+    :param table: name of the table
+    :param md5: MD5 checksum of the CSV file
+    """
+    sql = "INSERT OR REPLACE INTO %s (tableName, md5, loadedAt) VALUES (?, ?, ?)" % LOAD_STATE_TABLE
+    db.cursor.execute(sql, (table, md5, datetime.now().strftime(DATETIME_FORMAT)))
+    db.connection.commit()
+
+
+def update_tables(db:Database, csv_paths:Dict[str,Union[Path,str]],
+                  sql_path:Union[Path,str]=None, chunksize:int=100000,
+                  read_csv_kwargs:dict=None) -> Dict[str,int]:
+    """
+    upsert the tables whose CSV file has changed since the last load.
+    The change is detected by the MD5 checksum in the DVC file next to the
+    CSV file. The rows are matched by the primary key. Rows which are
+    removed from the CSV file are kept in the table.
+
+    :param db: Database to write (the tables must exist)
+    :param csv_paths: dict table -> path to the CSV file
+    :param sql_path: DDL to read the foreign keys from (default: db.sql_path)
+    :param chunksize: number of rows of a chunk
+    :param read_csv_kwargs: passed to pandas.read_csv
+    :return: dict table -> number of processed rows (for the updated tables)
+    """
+    sql_path = db.sql_path if sql_path is None else sql_path
+    if sql_path is None:
+        raise ValueError("sql_path is not given")
+
+    order = load_order(list(csv_paths.keys()), read_dependencies(sql_path))
+    checksums = read_checksums(db)
+
+    n_rows = {}
+    for table in order:
+        csv_path = Path(csv_paths[table])
+        md5 = read_dvc_md5(csv_path.with_name(csv_path.name + ".dvc"))
+
+        if checksums.get(table) == md5:
+            continue
+
+        n_rows[table] = db.insert_csv(csv_path, table, chunksize=chunksize,
+                                      read_csv_kwargs=read_csv_kwargs,
+                                      bulk=True, upsert=True)
+        save_checksum(db, table, md5)
+
+    return n_rows
@@ -2,20 +2,25 @@
 
 
 """
+import json
+from time import time
+from typing import Union
+from pathlib import Path
+
 import numpy as np
 import pandas as pd
-from sklearn.model_selection import GridSearchCV
-
-## for show_tree
-from sklearn.externals.six import StringIO
-from sklearn.tree import export_graphviz
-from IPython.display import Image
-import pydot
+## scikit-learn, scipy and joblib take about a second to import. They are
+## imported when a model is fitted or evaluated for the first time.
+from lib.lazy import LazyModule
+joblib = LazyModule("joblib")
+sparse = LazyModule("scipy.sparse")
+stats = LazyModule("scipy.stats")
+skbase = LazyModule("sklearn.base")
+metrics = LazyModule("sklearn.metrics")
+model_selection = LazyModule("sklearn.model_selection")
 
-## for ROCCurve class
-from sklearn.metrics import roc_curve, roc_auc_score
-from sklearn.metrics import recall_score, precision_score, f1_score
-import matplotlib.pyplot as plt
+## imported when a plot is drawn for the first time
+plt = LazyModule("matplotlib.pyplot")
 
 
 grid_params = {
@@ -40,9 +45,171 @@ grid_params = {
 }
 
 
-class MultiTransformer():
-    def __init__(self, cls, columns):
-        pass
+def _column(X, column) -> np.ndarray:
+    """
+    :return: the column of X as a 2D array with one column (no DataFrame copy)
+    """
+    if hasattr(X, "iloc"):
+        return X[column].to_numpy().reshape(-1, 1)
+    return np.asarray(X)[:, [column]]
+
+
+def _fit_column(transformer, x:np.ndarray):
+    return transformer.fit(x)
+
+
+def _transform_column(transformer, x:np.ndarray):
+    return transformer.transform(x)
+
+
+class MultiTransformer:
+    def __init__(self, cls, columns:list, remainder:str="drop", sparse_output:bool=None,
+                 dtype=np.float32, n_jobs:int=1):
+        """
+        Apply a transformer to each of the given columns separately, e.g.
+        OneHotEncoder or StandardScaler to hundreds of columns. A clone of the
+        transformer is fitted for each column and the columns are fitted and
+        transformed in parallel. The output is a single array (or a CSR matrix)
+        which is allocated once.
+
+        If cls is an instance, its parameters can be tuned in a Pipeline:
+
+            pipeline = Pipeline([("onehot", MultiTransformer(OneHotEncoder(), cats)),
+                                 ("model", LogisticRegression())])
+            param_grid = add_prefix_to_param("onehot", {"cls__min_frequency": [None, 10]})
+
+        :param cls: transformer class or instance (template of the transformers)
+        :param columns: column names (DataFrame) or indices (array) to transform
+        :param remainder: "drop" or "passthrough" for the other columns.
+                          The passed columns come after the transformed ones.
+        :param sparse_output: True for a CSR matrix, False for a dense array,
+                              None: sparse if a transformer returns a sparse matrix
+        :param dtype: dtype of the output
+        :param n_jobs: number of processes to fit/transform the columns
+        """
+        self.cls = cls
+        self.columns = columns
+        self.remainder = remainder
+        self.sparse_output = sparse_output
+        self.dtype = dtype
+        self.n_jobs = n_jobs
+
+
+    ## MultiTransformer does not inherit BaseEstimator so that importing this
+    ## module does not import scikit-learn. The methods below are the part of
+    ## the estimator API which Pipeline, clone and GridSearchCV use.
+    _param_names = ["cls", "columns", "remainder", "sparse_output", "dtype", "n_jobs"]
+
+    def get_params(self, deep:bool=True) -> dict:
+        """
+        :param deep: include the parameters of cls (as cls__<name>) if it is an instance
+        :return: parameters of the constructor
+        """
+        params = {name: getattr(self, name) for name in self._param_names}
+        if deep and hasattr(self.cls, "get_params") and not isinstance(self.cls, type):
+            params.update(("cls__%s" % k, v) for k, v in self.cls.get_params(deep=True).items())
+        return params
+
+
+    def set_params(self, **params) -> "MultiTransformer":
+        """
+        :param params: parameters of the constructor or cls__<name> for cls
+        :return: self
+        """
+        nested = {}
+        for key, value in params.items():
+            name, _, sub_key = key.partition("__")
+            if name not in self._param_names:
+                raise ValueError("Invalid parameter %s for MultiTransformer" % name)
+            if sub_key:
+                nested[sub_key] = value
+            else:
+                setattr(self, name, value)
+        if nested:
+            self.cls.set_params(**nested)
+        return self
+
+
+    def __repr__(self):
+        return "MultiTransformer(cls=%r, columns=%r)" % (self.cls, self.columns)
+
+
+    def _template(self):
+        return self.cls() if isinstance(self.cls, type) else skbase.clone(self.cls)
+
+
+    def _remainder_columns(self, X) -> list:
+        if self.remainder == "drop":
+            return []
+        elif self.remainder == "passthrough":
+            all_columns = list(X.columns) if hasattr(X, "columns") else list(range(np.shape(X)[1]))
+            return [col for col in all_columns if col not in set(self.columns)]
+        else:
+            raise ValueError("remainder must be 'drop' or 'passthrough'")
+
+
+    def fit(self, X, y=None) -> "MultiTransformer":
+        """
+        :param X: DataFrame or 2D array
+        :param y: ignored
+        :return: self
+        """
+        template = self._template()
+        self.transformers_ = joblib.Parallel(n_jobs=self.n_jobs)(
+            joblib.delayed(_fit_column)(skbase.clone(template), _column(X, col)) for col in self.columns
+        )
+        self.remainder_columns_ = self._remainder_columns(X)
+        return self
+
+
+    def transform(self, X):
+        """
+        :param X: DataFrame or 2D array with the columns given at fit
+        :return: array of dtype or CSR matrix
+        """
+        blocks = joblib.Parallel(n_jobs=self.n_jobs)(
+            joblib.delayed(_transform_column)(transformer, _column(X, col))
+            for transformer, col in zip(self.transformers_, self.columns)
+        )
+        blocks.extend(_column(X, col) for col in self.remainder_columns_)
+
+        is_sparse = any(sparse.issparse(block) for block in blocks) \
+            if self.sparse_output is None else self.sparse_output
+
+        if is_sparse:
+            return sparse.hstack(blocks, format="csr", dtype=self.dtype)
+
+        n_rows = blocks[0].shape[0] if blocks else np.shape(X)[0]
+        out = np.empty((n_rows, sum(block.shape[1] for block in blocks)), dtype=self.dtype)
+        start = 0
+        for block in blocks:
+            end = start + block.shape[1]
+            out[:, start:end] = block.toarray() if sparse.issparse(block) else block
+            start = end
+        return out
+
+
+    def fit_transform(self, X, y=None):
+        """
+        :param X: DataFrame or 2D array
+        :param y: ignored
+        :return: array of dtype or CSR matrix
+        """
+        return self.fit(X, y).transform(X)
+
+
+    def get_feature_names(self) -> list:
+        """
+        :return: names of the output columns. Use them for show_coefficients
+                 and show_feature_importance.
+        """
+        names = []
+        for transformer, col in zip(self.transformers_, self.columns):
+            if hasattr(transformer, "get_feature_names_out"):
+                names.extend(str(name) for name in transformer.get_feature_names_out([str(col)]))
+            else:
+                names.append(str(col))
+        return names + [str(col) for col in self.remainder_columns_]
 
 
 def add_prefix_to_param(prefix:str, param:dict) -> dict:
@@ -56,7 +223,7 @@ def add_prefix_to_param(prefix:str, param:dict) -> dict:
     return { "%s__%s" % (prefix,k): v for k,v in param.items()}
 
 
-def cv_results_summary(grid:GridSearchCV) -> pd.DataFrame:
+def cv_results_summary(grid:"GridSearchCV") -> pd.DataFrame:
     """
     Make the result of CV more smaller.
 
@@ -76,6 +243,346 @@ def cv_results_summary(grid:GridSearchCV) -> pd.DataFrame:
     return df.sort_index()
 
 
+def _take_rows(X, indices:np.ndarray):
+    """
+    :param X: DataFrame, Series, array, sparse matrix or list
+    :param indices: positions of the rows
+    :return: the rows of X in the same type
+    """
+    if hasattr(X, "iloc"):
+        return X.iloc[indices]
+    elif isinstance(X, (list, tuple)):
+        return [X[i] for i in indices]
+    elif hasattr(X, "tocsr"):
+        ## e.g. a COO matrix can not be indexed
+        return X.tocsr()[indices]
+    else:
+        return np.asarray(X)[indices]
+
+
+def _fit_and_score(estimator, X, y, train:np.ndarray, test:np.ndarray, scorer,
+                   cache_path:Path=None) -> dict:
+    """
+    fit the estimator on the training fold and score it on both folds.
+    The result is written to cache_path (atomically) if it is given.
+
+    :return: dict with test_score, train_score, fit_time and score_time
+    """
+    start = time()
+    estimator.fit(_take_rows(X, train), _take_rows(y, train))
+    fit_time = time() - start
+
+    start = time()
+    test_score = scorer(estimator, _take_rows(X, test), _take_rows(y, test))
+    score_time = time() - start
+    train_score = scorer(estimator, _take_rows(X, train), _take_rows(y, train))
+
+    result = {"test_score": float(test_score), "train_score": float(train_score),
+              "fit_time": fit_time, "score_time": score_time}
+
+    if cache_path is not None:
+        tmp_path = cache_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(result))
+        tmp_path.replace(cache_path)
+
+    return result
+
+
+class CachedGridSearch:
+    def __init__(self, estimator, param_grid:Union[dict,list], cache_dir:Union[Path,str],
+                 scoring=None, cv=5, n_jobs:int=1, refit:bool=True):
+        """
+        Grid search whose scores are cached on the disk for each candidate and
+        fold. The key of a score is the hash of (estimator with the parameters,
+        scoring, indices of the fold, X, y), so a candidate which has been
+        evaluated is never fitted again, even after the search is interrupted
+        or when a value is added to the grid.
+
+        cv_results_summary accepts a fitted instance.
+
+            grid = CachedGridSearch(RandomForestClassifier(), grid_params["RandomForest"],
+                                    cache_dir="cache/search", scoring="roc_auc", cv=3)
+            grid.fit(X, y)
+            cv_results_summary(grid)
+
+        :param estimator: scikit-learn estimator (or Pipeline)
+        :param param_grid: grid_param (dict) or list of them as GridSearchCV
+        :param cache_dir: directory for the cached scores
+        :param scoring: same as scoring of GridSearchCV (a single metric)
+        :param cv: same as cv of GridSearchCV. The folds must be deterministic.
+        :param n_jobs: number of processes to fit the candidates
+        :param refit: fit the best candidate on the whole data
+        """
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.cache_dir = Path(cache_dir)
+        self.scoring = scoring
+        self.cv = cv
+        self.n_jobs = n_jobs
+        self.refit = refit
+
+        self.cv_results_ = None
+        self.best_index_ = None
+        self.best_params_ = None
+        self.best_score_ = None
+        self.best_estimator_ = None
+        self.n_cached_ = 0 ## number of (candidate, fold) read from the cache
+        self.n_fitted_ = 0 ## number of (candidate, fold) fitted
+
+
+    def _cache_path(self, candidate, data_hash:str, train:np.ndarray, test:np.ndarray) -> Path:
+        scoring = self.scoring if self.scoring is None or isinstance(self.scoring, str) \
+            else joblib.hash(self.scoring)
+        key = joblib.hash((joblib.hash(candidate), scoring, data_hash,
+                           joblib.hash(train), joblib.hash(test)))
+        return self.cache_dir.joinpath("%s.json" % key)
+
+
+    def fit(self, X, y, groups=None) -> "CachedGridSearch":
+        """
+        evaluate the candidates which are not in the cache yet
+
+        :param X: feature matrix
+        :param y: target
+        :param groups: passed to the split method of cv
+        :return: self
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        candidates = list(model_selection.ParameterGrid(self.param_grid))
+        cv = model_selection.check_cv(self.cv, y, classifier=skbase.is_classifier(self.estimator))
+        folds = list(cv.split(X, y, groups))
+        scorer = metrics.check_scoring(self.estimator, scoring=self.scoring)
+        data_hash = joblib.hash((X, y))
+
+        results, tasks = {}, []
+        for i, params in enumerate(candidates):
+            candidate = skbase.clone(self.estimator).set_params(**params)
+            for j, (train, test) in enumerate(folds):
+                cache_path = self._cache_path(candidate, data_hash, train, test)
+                if cache_path.exists():
+                    results[i, j] = json.loads(cache_path.read_text())
+                else:
+                    tasks.append(((i, j), candidate, train, test, cache_path))
+
+        self.n_cached_, self.n_fitted_ = len(results), len(tasks)
+
+        ## each result is stored as soon as it is computed, so that an
+        ## interrupted search resumes from the last finished fit.
+        outputs = joblib.Parallel(n_jobs=self.n_jobs)(
+            joblib.delayed(_fit_and_score)(skbase.clone(candidate), X, y, train, test, scorer, cache_path)
+            for _, candidate, train, test, cache_path in tasks
+        )
+        results.update({task[0]: output for task, output in zip(tasks, outputs)})
+
+        self.cv_results_ = self._make_cv_results(candidates, len(folds), results)
+        self.best_index_ = int(np.argmin(self.cv_results_["rank_test_score"]))
+        self.best_params_ = candidates[self.best_index_]
+        self.best_score_ = self.cv_results_["mean_test_score"][self.best_index_]
+
+        if self.refit:
+            self.best_estimator_ = skbase.clone(self.estimator).set_params(**self.best_params_)
+            self.best_estimator_.fit(X, y)
+
+        return self
+
+
+    @staticmethod
+    def _make_cv_results(candidates:list, n_folds:int, results:dict) -> dict:
+        """
+        :return: cv_results_ in the format of GridSearchCV
+        """
+        cv_results = {"params": candidates}
+
+        param_names = sorted({k for params in candidates for k in params.keys()})
+        for name in param_names:
+            cv_results["param_%s" % name] = np.ma.masked_array(
+                [params.get(name) for params in candidates],
+                mask=[name not in params for params in candidates], dtype=object)
+
+        for metric in ["test_score", "train_score", "fit_time", "score_time"]:
+            values = np.array([[results[i, j][metric] for j in range(n_folds)]
+                               for i in range(len(candidates))])
+            if metric.endswith("_score"):
+                for j in range(n_folds):
+                    cv_results["split%d_%s" % (j, metric)] = values[:, j]
+            cv_results["mean_%s" % metric] = values.mean(axis=1)
+            cv_results["std_%s" % metric] = values.std(axis=1)
+
+        cv_results["rank_test_score"] = stats.rankdata(-cv_results["mean_test_score"],
+                                                       method="min").astype(np.int32)
+        return cv_results
+
+
+class SuccessiveHalvingSearch:
+    def __init__(self, estimator, param_grid:Union[dict,list], resource:str="n_samples",
+                 max_resources:int=None, min_resources:int=None, factor:int=3,
+                 scoring=None, cv=5, n_jobs:int=-1, refit:bool=True,
+                 random_state:int=None):
+        """
+        Budgeted alternative of GridSearchCV for the same grid_params (e.g. "XGB"
+        and "RandomForest"). All candidates are evaluated with a small resource
+        and only the best 1/factor of them go to the next iteration, where the
+        resource is multiplied by factor. The last iteration uses max_resources.
+
+        - resource="n_samples": the candidates are fitted on a random subsample
+          of each training fold. The test folds are not subsampled.
+        - resource=<parameter> (e.g. "n_estimators"): the parameter is set to the
+          resource. If the parameter is in the grid, it is removed from the grid
+          and its largest value is the default of max_resources. Otherwise
+          max_resources must be given.
+
+        The fits of each iteration run in parallel. cv_results_ has one row per
+        candidate and iteration (with "iter" and "n_resources") and the candidates
+        of later iterations are ranked higher, so that cv_results_summary shows
+        the survivors first.
+
+        :param estimator: scikit-learn estimator (or Pipeline)
+        :param param_grid: grid_param (dict) or list of them as GridSearchCV
+        :param resource: "n_samples" or the name of a parameter of the estimator
+        :param max_resources: resource of the last iteration (default: the number
+                              of samples of a training fold or the largest value
+                              of the parameter in the grid)
+        :param min_resources: resource of the first iteration
+                              (default: max_resources / factor**(number of iterations - 1))
+        :param factor: reduction factor of the candidates per iteration
+        :param scoring: same as scoring of GridSearchCV (a single metric)
+        :param cv: same as cv of GridSearchCV
+        :param n_jobs: number of processes (default: all cores)
+        :param refit: fit the best candidate on the whole data
+        :param random_state: seed of the subsamples
+        """
+        if factor < 2:
+            raise ValueError("factor must be at least 2")
+
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.resource = resource
+        self.max_resources = max_resources
+        self.min_resources = min_resources
+        self.factor = factor
+        self.scoring = scoring
+        self.cv = cv
+        self.n_jobs = n_jobs
+        self.refit = refit
+        self.random_state = random_state
+
+        self.cv_results_ = None
+        self.best_index_ = None
+        self.best_params_ = None
+        self.best_score_ = None
+        self.best_estimator_ = None
+        self.n_resources_ = None ## resource of each iteration
+        self.n_candidates_ = None ## number of candidates of each iteration
+
+
+    def _resources(self, n_candidates:int, n_train:int, max_resources:int=None) -> list:
+        if self.resource == "n_samples":
+            max_resources = n_train if max_resources is None else min(max_resources, n_train)
+        elif max_resources is None:
+            raise ValueError("max_resources must be given for resource=%s" % self.resource)
+
+        n_iterations = 1
+        while self.factor ** n_iterations < n_candidates:
+            n_iterations += 1
+
+        min_resources = max_resources // self.factor ** (n_iterations - 1) \
+            if self.min_resources is None else self.min_resources
+        min_resources = max(min_resources, 1)
+
+        ## the resource grows by factor and the last iteration uses max_resources
+        resources = [min(min_resources * self.factor ** i, max_resources) for i in range(n_iterations)]
+        resources[-1] = max_resources
+        return resources
+
+
+    def fit(self, X, y, groups=None) -> "SuccessiveHalvingSearch":
+        """
+        :param X: feature matrix
+        :param y: target
+        :param groups: passed to the split method of cv
+        :return: self
+        """
+        candidates = list(model_selection.ParameterGrid(self.param_grid))
+        max_resources = self.max_resources
+
+        if self.resource != "n_samples":
+            ## the resource is taken out of the grid (e.g. grid_params["RandomForest"])
+            values = [params.pop(self.resource) for params in candidates if self.resource in params]
+            if values and max_resources is None:
+                max_resources = max(values)
+            candidates = [params for i, params in enumerate(candidates) if params not in candidates[:i]]
+
+        cv = model_selection.check_cv(self.cv, y, classifier=skbase.is_classifier(self.estimator))
+        folds = list(cv.split(X, y, groups))
+        scorer = metrics.check_scoring(self.estimator, scoring=self.scoring)
+
+        ## a fixed random order of each training fold. A subsample is its head,
+        ## so that the subsamples of the iterations are nested.
+        random_state = np.random.RandomState(self.random_state)
+        shuffled = [random_state.permutation(train) for train, _ in folds]
+
+        resources = self._resources(len(candidates), min(len(train) for train, _ in folds),
+                                    max_resources)
+        self.n_resources_, self.n_candidates_ = [], []
+
+        rows, iterations, results = [], [], {}
+        survivors = list(range(len(candidates)))
+
+        with joblib.Parallel(n_jobs=self.n_jobs) as parallel:
+            for iteration, n_resources in enumerate(resources):
+                self.n_resources_.append(n_resources)
+                self.n_candidates_.append(len(survivors))
+
+                tasks = []
+                for i in survivors:
+                    params = dict(candidates[i])
+                    if self.resource != "n_samples":
+                        params[self.resource] = n_resources
+                    candidate = skbase.clone(self.estimator).set_params(**params)
+
+                    for j, (_, test) in enumerate(folds):
+                        train = np.sort(shuffled[j][:n_resources]) \
+                            if self.resource == "n_samples" else folds[j][0]
+                        tasks.append((len(rows), j, candidate, train, test))
+                    rows.append(candidates[i])
+                    iterations.append((iteration, n_resources))
+
+                outputs = parallel(joblib.delayed(_fit_and_score)(candidate, X, y, train, test, scorer)
+                                   for _, _, candidate, train, test in tasks)
+                results.update({(row, j): output for (row, j, _, _, _), output in zip(tasks, outputs)})
+
+                ## keep the best 1/factor of the candidates
+                scores = [np.mean([results[row, j]["test_score"] for j in range(len(folds))])
+                          for row in range(len(rows) - len(survivors), len(rows))]
+                n_keep = max(1, int(np.ceil(len(survivors) / self.factor)))
+                order = np.argsort(-np.array(scores), kind="mergesort")[:n_keep]
+                survivors = [survivors[k] for k in order]
+
+        self.cv_results_ = CachedGridSearch._make_cv_results(rows, len(folds), results)
+        self.cv_results_["iter"] = np.array([it for it, _ in iterations])
+        self.cv_results_["n_resources"] = np.array([r for _, r in iterations])
+
+        ## rank by the iteration first and then by the score
+        order = np.lexsort((-self.cv_results_["mean_test_score"], -self.cv_results_["iter"]))
+        ranks = np.empty(len(rows), dtype=np.int32)
+        ranks[order] = np.arange(1, len(rows) + 1)
+        self.cv_results_["rank_test_score"] = ranks
+
+        self.best_index_ = int(order[0])
+        self.best_params_ = rows[self.best_index_]
+        self.best_score_ = self.cv_results_["mean_test_score"][self.best_index_]
+
+        if self.refit:
+            params = dict(self.best_params_)
+            if self.resource != "n_samples":
+                params[self.resource] = resources[-1]
+            self.best_estimator_ = skbase.clone(self.estimator).set_params(**params)
+            self.best_estimator_.fit(X, y)
+
+        return self
+
+
 def show_coefficients(model, columns) -> pd.DataFrame:
     """
     Show the coefficients of variables in a linear model.
@@ -105,6 +612,10 @@ def show_tree(clf, columns):
     :param columns: names of columns
     :return: Image instance (for Jupyter)
     """
+    from io import StringIO
+    from sklearn.tree import export_graphviz
+    from IPython.display import Image
+    import pydot
 
     dot_data = StringIO()
     export_graphviz(clf, out_file=dot_data, feature_names=columns,
@@ -149,7 +660,7 @@ class ROCCurve:
             self.y_score = y_score
 
         self.pos_label = pos_label
-        self.fpr, self.tpr, self.thresholds = roc_curve(self.y_true, self.y_score, pos_label=1)
+        self.fpr, self.tpr, self.thresholds = metrics.roc_curve(self.y_true, self.y_score, pos_label=1)
         self.thresholds = self.thresholds[1:]
         self.scores = None
 
@@ -160,7 +671,7 @@ class ROCCurve:
 
         :return: AUC
         """
-        return roc_auc_score(self.y_true, self.y_score)
+        return metrics.roc_auc_score(self.y_true, self.y_score)
 
 
     def predict_thru_threshold(self, threshold) -> np.ndarray:
@@ -185,10 +696,10 @@ class ROCCurve:
 
         s = pd.Series(name="performance")
         s["threshold"] = threshold
-        s["recall"] = recall_score(self.y_true, y_pred)
-        s["precision"] = precision_score(self.y_true, y_pred)
+        s["recall"] = metrics.recall_score(self.y_true, y_pred)
+        s["precision"] = metrics.precision_score(self.y_true, y_pred)
         s["accuracy"] = np.mean(self.y_true == y_pred)
-        s["f1_score"] =  f1_score(self.y_true, y_pred)
+        s["f1_score"] =  metrics.f1_score(self.y_true, y_pred)
 
         fp = np.logical_and(self.y_true == 0, y_pred == 1).sum()
         tn_fp = np.sum(self.y_true == 0)
@@ -218,19 +729,47 @@ class ROCCurve:
         """
         computes recall, precision, FP-rate, accuracy and F1 score
         for each threshold. The result is returned as a DataFrame.
-        This can take a while because of a for-loop.
+
+        All thresholds are evaluated at once from the cumulative numbers
+        of true/false positives over the sorted scores (as roc_curve does).
+        The values agree with get_scores_thru_threshold.
 
         :return: DataFrame of metrics (Each row corresponds to a threshold.
         """
         if self.scores is None:
             cols = ["threshold", "recall", "precision", "fp_rate",
                     "accuracy", "f1_score"]
-            rows = []
-            for t in self.thresholds:
-                row = self.get_scores_thru_threshold(t)
-                rows.append([row[c] for c in cols])
 
-            self.scores = pd.DataFrame(rows, columns=cols).set_index(cols[0])
+            y_score = np.asarray(self.y_score)
+            thresholds = np.asarray(self.thresholds)
+
+            ## sort the scores in descending order. The i-th entry of tps/fps
+            ## is the number of TP/FP if we predict the first i+1 samples positive.
+            order = np.argsort(-y_score, kind="mergesort")
+            y_sorted = self.y_true[order]
+            tps = np.concatenate([[0], np.cumsum(y_sorted)])
+            fps = np.concatenate([[0], np.cumsum(1 - y_sorted)])
+
+            ## number of samples whose score >= threshold
+            n_pred = np.searchsorted(-y_score[order], -thresholds, side="right")
+            tp, fp = tps[n_pred], fps[n_pred]
+
+            n_pos = self.y_true.sum()
+            n_neg = len(self.y_true) - n_pos
+
+            ## sklearn returns 0 for the ill-defined cases
+            with np.errstate(divide="ignore", invalid="ignore"):
+                recall = np.where(n_pos > 0, tp / n_pos, 0.0)
+                precision = np.where(n_pred > 0, tp / n_pred, 0.0)
+                f1 = np.where(n_pred + n_pos > 0, 2 * tp / (n_pred + n_pos), 0.0)
+                fp_rate = fp / n_neg if n_neg > 0 else np.full(len(fp), np.nan)
+
+            accuracy = (tp + n_neg - fp) / len(self.y_true)
+
+            self.scores = pd.DataFrame(
+                np.column_stack([thresholds, recall, precision, fp_rate, accuracy, f1]),
+                columns=cols
+            ).set_index(cols[0])
 
         return self.scores
 
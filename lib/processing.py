@@ -2,43 +2,273 @@
 
 """
 
-from typing import Any
+import sys
+from typing import Any, Iterable, Callable
+from collections import OrderedDict
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-import scipy.stats as stats
 
-from pylab import rcParams
+from lib.sketch import HyperLogLog, ReservoirSample, KLLSketch, hash_values
+from lib.database import quote_identifier, quote_table
+from lib.lazy import LazyModule
+
+## imported when they are used for the first time
+plt = LazyModule("matplotlib.pyplot")
+sns = LazyModule("seaborn")
+stats = LazyModule("scipy.stats")
+sparse = LazyModule("scipy.sparse")
 
 import warnings
 warnings.filterwarnings("ignore", category=FutureWarning)
 
+## Batched engine for significance tests. A column is prepared only once:
+## - categorical: ("cat", codes of pd.factorize (-1 for NA), number of levels)
+## - continuous: ("con", values, ranks (None if the column has NA))
+## The functions are defined on the module level to run in a process pool.
+
+def _prepare_column(s:pd.Series, is_cat:bool) -> tuple:
+    if is_cat:
+        codes, uniques = pd.factorize(s)
+        return "cat", codes, len(uniques)
+    else:
+        values = s.values.astype(np.float64)
+        ranks = None if np.isnan(values).any() else stats.rankdata(values)
+        return "con", values, ranks
+
+
+def _chi_square_test(codes1:np.ndarray, n1:int, codes2:np.ndarray, n2:int) -> tuple:
+    """
+    chi-square test on the contingency table built with np.bincount.
+    Rows with NA are ignored as pd.crosstab does.
+
+    :return: statistic, p-value, True if the table contains a cell smaller than 5
+    """
+    valid = (codes1 >= 0) & (codes2 >= 0)
+    table = np.bincount(codes1[valid] * n2 + codes2[valid], minlength=n1 * n2).reshape(n1, n2)
+    table = table[table.sum(axis=1) > 0][:, table.sum(axis=0) > 0]
+
+    statistic, pval, dof, exp = stats.chi2_contingency(table)
+    return statistic, pval, bool((table < 5).any())
+
+
+def _rank_correlation_test(ranks1:np.ndarray, ranks2:np.ndarray) -> tuple:
+    """
+    Spearman correlation as the Pearson correlation of ranks.
+    The p-value is computed by the t-distribution as scipy.stats.spearmanr.
+    """
+    if ranks1 is None or ranks2 is None:
+        return np.nan, np.nan
+
+    n = len(ranks1)
+    r = np.corrcoef(ranks1, ranks2)[0, 1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = r * np.sqrt((n - 2) / ((r + 1.0) * (1.0 - r)))
+    pval = 2 * stats.t.sf(np.abs(t), n - 2)
+    return r, pval
+
+
+def _kruskal_test(codes:np.ndarray, n_levels:int, values:np.ndarray, ranks:np.ndarray) -> tuple:
+    """
+    Kruskal-Wallis H-test computed from the rank sums of the groups.
+    Groups (values of the categorical variable) with less than 5 samples
+    and rows with NA in the categorical variable are ignored.
+
+    :return: statistic, p-value, True if a group is ignored
+    """
+    valid = codes >= 0
+    sizes = np.bincount(codes[valid], minlength=n_levels)
+    keep = sizes >= 5
+
+    mask = valid.copy()
+    mask[valid] = keep[codes[valid]]
+    ignored = bool((~keep).any() or (~valid).any())
+
+    if keep.sum() < 2:
+        raise ValueError("Need at least two groups in stats.kruskal()")
+
+    if np.isnan(values[mask]).any():
+        return np.nan, np.nan, ignored
+
+    ## the ranks of the whole column can be used if no row is ignored
+    r = ranks if (ranks is not None and mask.all()) else stats.rankdata(values[mask])
+
+    n = len(r)
+    rank_sums = np.bincount(codes[mask], weights=r, minlength=n_levels)[keep]
+    statistic = 12.0 / (n * (n + 1)) * np.sum(rank_sums ** 2 / sizes[keep]) - 3 * (n + 1)
+    statistic /= stats.tiecorrect(r)
+    pval = stats.chi2.sf(statistic, keep.sum() - 1)
+    return statistic, pval, ignored
+
+
+def _test_prepared(field1:str, column1:tuple, field2:str, column2:tuple,
+                   method:str="spearman") -> tuple:
+    """
+    the same test as Inspector.significance_test on prepared columns
+
+    :return: (field1, field2, test, statistic, pval, message or None)
+    """
+    message = None
+
+    if column1[0] == "cat" and column2[0] == "cat":
+        test = "chi-square test"
+        statistic, pval, small = _chi_square_test(column1[1], column1[2], column2[1], column2[2])
+        if small:
+            message = "The contigency table (%s vs %s) contains too small cell(s)." % (field1, field2)
+
+    elif column1[0] == "con" and column2[0] == "con":
+        if method == "spearman":
+            test = "Spearman correlation"
+            statistic, pval = _rank_correlation_test(column1[2], column2[2])
+        else:
+            test = "Peason correlation"
+            statistic, pval = stats.pearsonr(column1[1], column2[1])
+
+    else:
+        test = "one-way ANOVA on ranks"
+        cat, con = (column1, column2) if column1[0] == "cat" else (column2, column1)
+        statistic, pval, ignored = _kruskal_test(cat[1], cat[2], con[1], con[2])
+        if ignored:
+            message = "The groups withe less than 5 samples will be ignored."
+
+    return field1, field2, test, statistic, pval, message
+
+
+def _test_against_target(feature:tuple, target:tuple, method:str) -> tuple:
+    return _test_prepared(feature[0], feature[1], target[0], target[1], method=method)
+
+
+def _nbytes(value:Any) -> int:
+    """
+    approximate memory usage of a cached value
+    """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True).sum())
+    elif isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True))
+    elif isinstance(value, np.ndarray):
+        return value.nbytes
+    elif isinstance(value, (list, tuple)):
+        return sum(_nbytes(v) for v in value)
+    else:
+        return sys.getsizeof(value)
+
+
+def _column_version(s:pd.Series) -> tuple:
+    """
+    identity of the values of a column. It changes when the column of the
+    DataFrame is replaced (df[field] = ...), but not when the values are
+    modified in place.
+    """
+    if isinstance(s.dtype, np.dtype):
+        ## a view of the column, whose address does not change
+        return s.to_numpy().__array_interface__["data"][0], len(s)
+    else:
+        return id(s.array), len(s)
+
+
+class _LRUCache:
+    def __init__(self, max_bytes:int):
+        """
+        LRU cache whose keys are tuples (kind, field, ...). The least
+        recently used entries are removed if the total size exceeds max_bytes.
+
+        :param max_bytes: memory bound of the cache
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = OrderedDict() ## key -> (value, size, version)
+
+
+    def get(self, key:tuple, compute:Callable[[], Any], version:Any=None) -> Any:
+        """
+        :param key: (kind, field, ...)
+        :param compute: function computing the value
+        :param version: the cached value is recomputed if its version differs
+        :return: value
+        """
+        if key in self.entries:
+            if self.entries[key][2] == version:
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+            _, size, _ = self.entries.pop(key)
+            self.nbytes -= size
+
+        value = compute()
+        size = _nbytes(value)
+
+        if size <= self.max_bytes:
+            self.entries[key] = (value, size, version)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, removed, _) = self.entries.popitem(last=False)
+                self.nbytes -= removed
+
+        return value
+
+
+    def invalidate(self, fields:set=None):
+        """
+        remove the entries involving one of the fields (default: all entries)
+        """
+        for key in list(self.entries.keys()):
+            if fields is None or fields.intersection(key[1:]):
+                _, size, _ = self.entries.pop(key)
+                self.nbytes -= size
+
+
 class Inspector:
+    _cache = None ## subclasses without self.data have no cache
 
-    def __init__(self, df:pd.DataFrame, m_cats:int=20):
+    def __init__(self, df:pd.DataFrame, m_cats:int=20, n_jobs:int=1,
+                 cache_bytes:int=256*2**20):
         """
         Construct an inspection DataFrame of the given one
         Note that missing values are ignored for n_unique
 
+        Factorized codes, contingency tables and group partitions which are
+        computed for the tests and the visualizations are cached. The cache
+        is invalidated when the classification of a field changes or a column
+        of df is replaced. Call clear_cache after modifying df in place.
+
         :param df: DataFrame to analyze
         :param m_cats: maximum number of values of a categorical variable
+        :param n_jobs: number of threads to inspect the columns
+        :param cache_bytes: memory bound of the cache
         """
         self.data = df ## Do not take a copy. A reference is better.
         self._m_cats = m_cats
+        self.n_jobs = n_jobs
+        self._cache = _LRUCache(cache_bytes)
         self.inspection = None
         self.make_an_inspection()
 
 
     def make_an_inspection(self):
+        na = self.data.isna()
+
+        def inspect_column(field) -> tuple:
+            s = self.data[field]
+            not_na = ~na[field].values
+            return s.nunique(dropna=True), self._sample_value(s, not_na)
+
+        if self.n_jobs > 1:
+            with ThreadPoolExecutor(self.n_jobs) as executor:
+                results = list(executor.map(inspect_column, self.data.columns))
+        else:
+            results = [inspect_column(field) for field in self.data.columns]
+
+        self.clear_cache()
+
         self.inspection = pd.DataFrame(self.data.dtypes, columns=["dtype"])
-        self.inspection["count_na"] = self.data.isna().sum()
-        self.inspection["rate_na"] = self.data.isna().mean()
-        self.inspection["n_unique"] = self.data.apply(lambda x: len(x.dropna(how="any").unique()), axis=0)
+        self.inspection["count_na"] = na.sum()
+        self.inspection["rate_na"] = self.inspection["count_na"] / self.data.shape[0]
+        self.inspection["n_unique"] = [n_unique for n_unique, _ in results]
         self.inspection["distinct"] = self.inspection["n_unique"] == self.data.shape[0]
         self.m_cats = self._m_cats
-        self.inspection["sample_value"] = self.data.apply(self.sample_value, axis=0)
+        self.inspection["sample_value"] = [value for _, value in results]
         return self
 
 
@@ -50,7 +280,7 @@ class Inspector:
     def m_cats(self, m_cats:int=20):
         """
         The threshold of the categorical and continuous variables for numerical variable.
-        (A variable of "object" is always categorical.)
+        (A variable of "object" or a string dtype is always categorical.)
 
         Detect the type of fields.
 
@@ -72,28 +302,119 @@ class Inspector:
                 return "constant"
             elif s["n_unique"] == 2:
                 return "binary"
-            elif s["dtype"] == "object" or s["n_unique"] <= self._m_cats:
+            elif pd.api.types.is_string_dtype(s["dtype"]) or s["n_unique"] <= self._m_cats:
                 return "categorical"
             else:
                 return "continuous"
 
+        previous = self.inspection.get("variable")
         self.inspection["variable"] = self.inspection.apply(get_vtype, axis=1)
 
+        if previous is not None:
+            changed = self.inspection.index[self.inspection["variable"] != previous]
+            self._invalidate_cache(set(changed))
+
+
+    def _invalidate_cache(self, fields:set):
+        if self._cache is not None and fields:
+            self._cache.invalidate(fields)
+
+
+    def clear_cache(self):
+        """
+        remove the cached codes, contingency tables and group partitions.
+        A replaced column (df[field] = ...) is detected, but a modification
+        in place (e.g. df.loc[0, field] = value) is not, so call this after it.
+        """
+        if self._cache is not None:
+            self._cache.invalidate()
+
+
+    def _require_data(self, method:str):
+        """
+        raise NotImplementedError if the inspector does not keep the data
+        (StreamingInspector, SQLInspector)
+
+        :param method: name of the method which needs the whole data
+        """
+        if self.data is None:
+            raise NotImplementedError("%s needs the whole data and is not available for %s"
+                                      % (method, type(self).__name__))
+
+
+    def _version(self, *fields) -> tuple:
+        return tuple(_column_version(self.data[field]) for field in fields)
+
+
+    def _factorize(self, field:str) -> tuple:
+        """
+        :return: codes (-1 for NA), sorted unique values
+        """
+        return self._cache.get(("codes", field),
+                               lambda: pd.factorize(self.data[field], sort=True),
+                               self._version(field))
+
+
+    def _codes(self, field:str) -> tuple:
+        """
+        :return: codes of pd.factorize (-1 for NA), number of levels
+        """
+        codes, uniques = self._factorize(field)
+        return codes, len(uniques)
+
+
+    def _crosstab(self, field1:str, field2:str) -> pd.DataFrame:
+        """
+        :return: pd.crosstab of the fields. Do not modify it.
+        """
+        return self._cache.get(("crosstab", field1, field2),
+                               lambda: pd.crosstab(self.data[field1], self.data[field2]),
+                               self._version(field1, field2))
+
+
+    def _group_samples(self, cat:str, con:str) -> list:
+        """
+        split the values of con by the values of cat (in the sorted order).
+        An empty group is added if cat contains NA. Do not modify the arrays.
+
+        :return: list of arrays
+        """
+        def partition():
+            codes, n_levels = self._codes(cat)
+            order = np.argsort(codes, kind="mergesort")
+            sizes = np.bincount(codes + 1, minlength=n_levels + 1)
+            groups = np.split(self.data[con].values[order], np.cumsum(sizes)[:-1])
+            return groups[1:] + ([groups[0][:0]] if sizes[0] > 0 else [])
+
+        return self._cache.get(("groups", cat, con), partition, self._version(cat, con))
+
 
     def sample_value(self, s:pd.Series, seed:int=None) -> Any:
         """
         return a non-missing value of the column in a random way.
         If the column has only missing values, then it will be returned.
+        The value is taken from a random row, so that a frequent value
+        is chosen more often.
 
         :return: a value
         """
         if seed is not None:
             np.random.seed(seed)
 
-        s = s.dropna(how="any").unique()
+        return self._sample_value(s, s.notna().values)
+
+
+    @staticmethod
+    def _sample_value(s:pd.Series, not_na:np.ndarray) -> Any:
+        """
+        :param s: Series
+        :param not_na: boolean array (True for a non-missing value)
+        :return: the value of a random non-missing row or NaN
+        """
+        positions = np.flatnonzero(not_na)
 
-        if len(s):
-            return np.random.choice(s,1)[0]
+        if len(positions):
+            return s.iloc[positions[np.random.randint(len(positions))]]
         else:
             return np.nan
 
@@ -107,6 +428,8 @@ class Inspector:
         """
         valid_types = ["constant", "continuous", "binary", "categorical"]
         if variable in valid_types:
+            if self.inspection.loc[field,"variable"] != variable:
+                self._invalidate_cache({field})
             self.inspection.loc[field,"variable"] = variable
         else:
             print("variable must be one of the following: %s" % ", ".join(['"%s"' % x for x in valid_types]))
@@ -145,31 +468,50 @@ class Inspector:
 
 
     ## information about distribution in DataFrame
-    def distribution_cats(self, fields:list=None):
+    def distribution_cats(self, fields:list=None, top_k:int=None):
         """
         return a DataFrame showing the distribution of the categorical variables.
+        The values are counted by bincount of the (cached) factorized codes and
+        the result is built at once.
 
         :param fields: list of (categorical) fields to check
+        :param top_k: if given, only the top_k most frequent values of each
+                      field are shown in descending order of the count.
+                      Otherwise all values are shown in the sorted order.
         :return: DataFrame of distributions
         """
+        self._require_data("distribution_cats")
 
         if fields is None:
             fields = self.get_cats()
 
-        df_dist = []
+        field_list, value_list, count_list = [], [], []
 
         for field in fields:
-            s = self.data[field]
+            codes, uniques = self._factorize(field)
 
-            df_tmp = s.value_counts(dropna=False).sort_index().reset_index()
-            df_tmp.columns = ["value", "count"]
-            df_tmp["field"] = field
-            df_tmp.set_index(["field","value"], inplace=True)
-            df_tmp["rate"] = df_tmp["count"]/len(s)
+            ## NA (code -1) is moved to the last slot as sort_index() does
+            counts = np.roll(np.bincount(codes + 1, minlength=len(uniques) + 1), -1)
+            values = np.append(np.asarray(uniques, dtype=object), np.nan)
 
-            df_dist.append(df_tmp)
+            positions = np.flatnonzero(counts)
+            if top_k is not None:
+                order = np.argsort(-counts[positions], kind="mergesort")
+                positions = positions[order[:top_k]]
 
-        return pd.concat(df_dist, axis=0)
+            field_list.append(np.repeat(field, len(positions)))
+            value_list.append(values[positions])
+            count_list.append(counts[positions])
+
+        if not fields:
+            field_list, value_list, count_list = [[]], [[]], [[]]
+
+        index = pd.MultiIndex.from_arrays([np.concatenate(field_list),
+                                           np.concatenate(value_list)],
+                                          names=["field", "value"])
+        df_dist = pd.DataFrame({"count": np.concatenate(count_list).astype(np.int64)}, index=index)
+        df_dist["rate"] = df_dist["count"]/self.data.shape[0]
+        return df_dist
 
 
     def distribution_cons(self,fields:list=None):
@@ -180,6 +522,7 @@ class Inspector:
         :param fields: list of continuous fields to check
         :return: DataFrame of distributions
         """
+        self._require_data("distribution_cons")
 
         if fields is None:
             fields = self.get_cons()
@@ -199,6 +542,7 @@ class Inspector:
         :param method: "spearman" (default) or "pearson"
         :return: Series with index: field1, field2, test, statistic, pval
         """
+        self._require_data("significance_test")
 
         cats = self.get_cats()
         cons = self.get_cons()
@@ -206,7 +550,7 @@ class Inspector:
         if field1 in cats and field2 in cats:
             #### chi2-test
             test = "chi-square test"
-            contigency_table = pd.crosstab(self.data[field1], self.data[field2])
+            contigency_table = self._crosstab(field1, field2)
 
             if (contigency_table < 5).sum().sum() > 0:
                 print("The contigency table (%s vs %s) contains too small cell(s)." % (field1,field2))
@@ -235,9 +579,7 @@ class Inspector:
             else:
                 raise ValueError("You gave a wrong field.")
 
-            vals = self.data[cat].unique()
-
-            samples = [self.data.loc[self.data[cat] == v, con] for v in vals]
+            samples = self._group_samples(cat, con)
 
             if any([len(s) < 5 for s in samples]):
                 print("The groups withe less than 5 samples will be ignored.")
@@ -250,46 +592,256 @@ class Inspector:
         return s
 
 
-    def significance_test_features(self, target) -> pd.DataFrame:
+    def significance_test_features(self, target, method:str="spearman",
+                                   n_jobs:int=1) -> pd.DataFrame:
         """
-        Check the significance of feature variables against the target variables
+        Check the significance of feature variables against the target variables.
+        The tests are the same as significance_test, but each column is factorized
+        or ranked only once and the tests can run in a process pool.
 
         :param target: the target variable
+        :param method: "spearman" (default) or "pearson"
+        :param n_jobs: number of processes
         :return: DataFrame containing the result of tests
         """
-        fields = [f for f in self.data.columns if f != target]
+        self._require_data("significance_test_features")
+        cats = set(self.get_cats())
+        cons = set(self.get_cons())
+
+        def prepare(field:str) -> tuple:
+            if field in cats:
+                return field, ("cat",) + self._codes(field)
+            elif field in cons:
+                return field, _prepare_column(self.data[field], False)
+            else:
+                raise ValueError("You gave a wrong field.")
+
+        prepared_target = prepare(target)
+        features = [prepare(f) for f in self.data.columns if f != target]
+        test = partial(_test_against_target, target=prepared_target, method=method)
+
+        if n_jobs > 1:
+            chunksize = max(1, int(np.ceil(len(features) / n_jobs)))
+            with ProcessPoolExecutor(n_jobs) as executor:
+                results = list(executor.map(test, features, chunksize=chunksize))
+        else:
+            results = [test(feature) for feature in features]
+
+        for result in results:
+            if result[-1] is not None:
+                print(result[-1])
+
+        return pd.DataFrame([result[:-1] for result in results],
+                            columns=["field1", "field2", "test", "statistic", "pval"])
+
+
+    def association_matrix(self, fields:list=None, method:str="spearman",
+                           block_size:int=100) -> pd.DataFrame:
+        """
+        Execute the test of significance_test for all pairs of fields.
+        Constant fields are skipped. Messages about small cells or groups
+        are not shown.
+
+        - continuous vs continuous: one matrix product of the standardized
+          ranks (or values for "pearson") per block of columns
+        - categorical vs categorical: contingency tables by np.bincount
+        - categorical vs continuous: rank sums of all groups by one sparse
+          matrix product per block of columns
+
+        Use e.g. df.pivot(index="field1", columns="field2", values="pval")
+        to get the result as a matrix.
+
+        :param fields: fields to test (default: all fields). Constant fields are skipped.
+        :param method: "spearman" (default) or "pearson"
+        :param block_size: number of continuous columns processed at once
+        :return: DataFrame with columns field1, field2, test, statistic, pval
+        """
+        self._require_data("association_matrix")
+        cats = self.get_cats()
+        cons = self.get_cons()
+
+        if fields is None:
+            fields = list(self.data.columns)
+
+        unknown = [f for f in fields if f not in self.inspection.index]
+        if unknown:
+            raise ValueError("Unknown fields: %s" % ", ".join(map(str, unknown)))
+
+        fields = [f for f in fields if f in cats or f in cons]
+
+        cat_fields = [f for f in fields if f in cats]
+        con_fields = [f for f in fields if f in cons]
+        results = {}
+
+        ## continuous vs continuous
+        prepared = {f: _prepare_column(self.data[f], False) for f in con_fields}
+        n = self.data.shape[0]
+        name = "Spearman correlation" if method == "spearman" else "Peason correlation"
+
+        ok = [f for f in con_fields if prepared[f][2] is not None] ## without NA
+        for i, f1 in enumerate(con_fields):
+            for f2 in con_fields[i+1:]:
+                if prepared[f1][2] is None or prepared[f2][2] is None:
+                    results[(f1, f2)] = (name, np.nan, np.nan)
+
+        blocks = [ok[i:i+block_size] for i in range(0, len(ok), block_size)]
+        rank_blocks = [np.column_stack([prepared[f][2] for f in block]) for block in blocks]
+
+        def standardize(X:np.ndarray) -> np.ndarray:
+            X = X - X.mean(axis=0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return X / np.sqrt((X ** 2).sum(axis=0))
+
+        if method == "spearman":
+            z_blocks = [standardize(R) for R in rank_blocks]
+        else:
+            z_blocks = [standardize(np.column_stack([prepared[f][1] for f in block])) for block in blocks]
+
+        for bi, block1 in enumerate(blocks):
+            for bj in range(bi, len(blocks)):
+                block2 = blocks[bj]
+                R = np.clip(z_blocks[bi].T @ z_blocks[bj], -1.0, 1.0)
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    T = R * np.sqrt((n - 2) / ((1.0 + R) * (1.0 - R)))
+                P = 2 * stats.t.sf(np.abs(T), n - 2)
+
+                ## upper triangle only for a diagonal block
+                I, J = np.triu_indices(len(block1), k=1, m=len(block2)) if bi == bj \
+                    else np.indices(R.shape).reshape(2, -1)
+                for i, j, r, pval in zip(I, J, R[I, J], P[I, J]):
+                    results[(block1[i], block2[j])] = (name, r, pval)
+
+        ## categorical vs categorical
+        prepared.update({f: ("cat",) + self._codes(f) for f in cat_fields})
+        for i, f1 in enumerate(cat_fields):
+            for f2 in cat_fields[i+1:]:
+                (_, codes1, n1), (_, codes2, n2) = prepared[f1], prepared[f2]
+                statistic, pval, _ = _chi_square_test(codes1, n1, codes2, n2)
+                results[(f1, f2)] = ("chi-square test", statistic, pval)
+
+        ## categorical vs continuous
+        ties = {f: stats.tiecorrect(prepared[f][2]) for f in ok}
+        for cat in cat_fields:
+            _, codes, n_levels = prepared[cat]
+            sizes = np.bincount(codes[codes >= 0], minlength=n_levels)
+
+            if (codes >= 0).all() and (sizes >= 5).all() and n_levels >= 2:
+                fast = set(ok)
+                indicator = sparse.csr_matrix((np.ones(n), (codes, np.arange(n))), shape=(n_levels, n))
+                for block, ranks in zip(blocks, rank_blocks):
+                    rank_sums = indicator @ ranks
+                    H = 12.0 / (n * (n + 1)) * (rank_sums ** 2 / sizes[:, None]).sum(axis=0) - 3 * (n + 1)
+                    H = H / np.array([ties[f] for f in block])
+                    P = stats.chi2.sf(H, n_levels - 1)
+                    for j, con in enumerate(block):
+                        results[(cat, con)] = ("one-way ANOVA on ranks", H[j], P[j])
+            else:
+                fast = set()
+
+            for con in [f for f in con_fields if f not in fast]:
+                _, values, ranks = prepared[con]
+                try:
+                    statistic, pval, _ = _kruskal_test(codes, n_levels, values, ranks)
+                except ValueError:
+                    ## less than two groups with 5 samples: no test for this pair
+                    statistic, pval = np.nan, np.nan
+                results[(cat, con)] = ("one-way ANOVA on ranks", statistic, pval)
+
+        rows = []
+        for i, f1 in enumerate(fields):
+            for f2 in fields[i+1:]:
+                key = (f1, f2) if (f1, f2) in results else (f2, f1)
+                rows.append((f1, f2) + results[key])
+
+        return pd.DataFrame(rows, columns=["field1", "field2", "test", "statistic", "pval"])
+
+
+    def stratified_sample(self, cat:str, fields:list, max_points:int,
+                          seed:int=None, max_levels:int=None) -> pd.DataFrame:
+        """
+        sample at most about max_points rows so that each value of cat keeps
+        its share. Every value of cat keeps at least one row. NA is regarded
+        as a value.
+
+        Only the max_levels most frequent values are strata of their own. The
+        other values are folded into one stratum, so that the sample has at
+        most max_points + max_levels + 1 rows even if cat has many values.
+
+        :param cat: categorical field to stratify by
+        :param fields: fields of the sample
+        :param max_points: number of rows to sample
+        :param seed: seed of the sampling
+        :param max_levels: number of values kept as strata (default: max_points // 10)
+        :return: DataFrame of the sampled rows (in the original order)
+        """
+        self._require_data("stratified_sample")
+        n_rows = self.data.shape[0]
+        if n_rows <= max_points:
+            return self.data[fields]
+
+        codes, uniques = self._factorize(cat)
+        codes = codes + 1 ## NA -> 0
+        sizes = np.bincount(codes, minlength=len(uniques) + 1)
 
-        results = [self.significance_test(field, target) for field in fields]
-        return pd.concat(results, axis=1).T
+        if max_levels is None:
+            max_levels = max(max_points // 10, 1)
+        if np.count_nonzero(sizes) > max_levels:
+            ## the rare values share the last stratum
+            strata = np.full(len(sizes), max_levels)
+            strata[np.argsort(-sizes, kind="stable")[:max_levels]] = np.arange(max_levels)
+            codes = strata[codes]
+            sizes = np.bincount(codes, minlength=max_levels + 1)
+
+        n_samples = np.minimum(sizes, np.maximum(np.ceil(max_points * sizes / n_rows), 1))
+
+        ## random order within each stratum. The first n_samples rows are taken.
+        random_keys = np.random.RandomState(seed).random_sample(n_rows)
+        order = np.lexsort((random_keys, codes))
+        starts = np.cumsum(sizes) - sizes
+        rank_in_stratum = np.arange(n_rows) - starts[codes[order]]
+        chosen = np.sort(order[rank_in_stratum < n_samples[codes[order]]])
+
+        return self.data[fields].iloc[chosen]
 
 
     def visualize_two_fields(self, field1:str, field2:str,
                              proportion:bool=False,
-                             rotation:float=0.0):
+                             rotation:float=0.0,
+                             max_points:int=None,
+                             bins:int=50,
+                             seed:int=None):
         """
         Draw an informative diagramm for given two fields (feature and target).
         Note that this method can accept no constant field.
 
+        If max_points is given and the data has more rows, the violin plot
+        and the KDE are drawn with a stratified sample (see stratified_sample)
+        and two continuous fields are drawn as a 2D histogram computed by
+        NumPy instead of a joint plot with a regression line.
+
         :param field1: feature variable
         :param field2: target variable
         :param proportion: proportion instead of distribution
         :param rotation: rotation of xticks
+        :param max_points: maximum number of rows to draw
+        :param bins: number of bins of the 2D histogram for each axis
+        :param seed: seed of the sampling
         """
+        self._require_data("visualize_two_fields")
 
         cats = self.get_cats()
         cons = self.get_cons()
+        downsample = max_points is not None and self.data.shape[0] > max_points
 
-        width, height = rcParams['figure.figsize']
+        width, height = plt.rcParams['figure.figsize']
         aspect = width / height
 
         if field1 in cats and field2 in cats:
             ## bar chart
-            df_tmp = pd.crosstab(self.data[field1], self.data[field2])
+            df_tmp = self._crosstab(field1, field2)
 
             if proportion:
-                bucket_size = df_tmp.sum(axis=1)
-                for col in df_tmp.columns:
-                    df_tmp[col] = df_tmp[col] / bucket_size ## normalize
+                df_tmp = df_tmp.div(df_tmp.sum(axis=1), axis=0) ## normalize
 
                 df_tmp.plot.bar(stacked=True)
                 title = "Proportion of %s by %s" % (field2, field1)
@@ -301,18 +853,33 @@ class Inspector:
 
         elif field1 in cats and field2 in cons:
             ## violine
-            sns.violinplot(field1, field2, data=self.data,
+            data = self.stratified_sample(field1, [field1, field2], max_points, seed) \
+                if downsample else self.data
+            sns.violinplot(field1, field2, data=data,
                            inner="quartile")
             title = "Distribution of %s by %s" % (field2, field1)
 
         elif field1 in cons and field2 in cats:
             ## KDE
-            sns.FacetGrid(self.data, hue=field2,
+            data = self.stratified_sample(field2, [field1, field2], max_points, seed) \
+                if downsample else self.data
+            sns.FacetGrid(data, hue=field2,
                           height=height, aspect=aspect, legend_out=False)\
                .map(sns.kdeplot, field1, shade=True).add_legend()
             plt.ylabel("density")
             title = "Kernel distribution estimate of %s by %s" % (field1,field2)
 
+        elif field1 in cons and field2 in cons and downsample:
+            ## 2D histogram
+            df_tmp = self.data[[field1, field2]].dropna()
+            counts, xedges, yedges = np.histogram2d(df_tmp[field1].values,
+                                                    df_tmp[field2].values, bins=bins)
+            plt.pcolormesh(xedges, yedges, np.ma.masked_equal(counts.T, 0), cmap="Blues")
+            plt.colorbar(label="count")
+            plt.xlabel(field1)
+            plt.ylabel(field2)
+            title = "Joint distribution of %s and %s" % (field1, field2)
+
         elif field1 in cons and field2 in cons:
             ## joint plot
             sns.jointplot(field1, field2, data=self.data, kind="reg",
@@ -326,3 +893,435 @@ class Inspector:
         plt.title(title)
         plt.show()
 
+
+class StreamingInspector(Inspector):
+
+    def __init__(self, chunks:Iterable[pd.DataFrame], m_cats:int=20,
+                 p:int=14, k:int=200, seed:int=None):
+        """
+        Construct an inspection of a table which is given chunk by chunk
+        (e.g. Database.iter_table). Only sketches of the columns are kept,
+        so the memory does not depend on the number of rows.
+
+        - count_na, rate_na: exact
+        - n_unique: HyperLogLog (relative standard error in n_unique_error)
+        - distinct: n_unique is within 3 standard errors from the number of rows
+        - sample_value: reservoir sampling
+        - distribution_cons: exact count/mean/std/min/max and quantiles
+          by KLL sketches (normalized rank error in rank_error)
+
+        The methods which need the whole data (distribution_cats,
+        significance tests and visualizations) are not available.
+
+        :param chunks: iterable of DataFrames with the same columns
+        :param m_cats: maximum number of values of a categorical variable
+        :param p: precision of HyperLogLog
+        :param k: size parameter of the KLL sketches
+        :param seed: seed for the sampling and the KLL sketches
+        """
+        self.data = None
+        self._m_cats = m_cats
+        self.p = p
+        self.k = k
+        self.random_state = np.random.RandomState(seed)
+
+        self.n_rows = 0
+        self.dtypes = None
+        self.count_na = None
+        self.hll = {}
+        self.reservoir = {}
+        self.kll = {}
+        self.moments = {} ## field -> [count, mean, M2, min, max]
+
+        for chunk in chunks:
+            self.update(chunk)
+
+        self.inspection = None
+        self.make_an_inspection()
+
+
+    @classmethod
+    def from_database(cls, db, table:str, chunksize:int=100000, **kwargs):
+        """
+        :param db: Database
+        :param table: name of the table
+        :param chunksize: number of rows of a chunk
+        :param kwargs: passed to the constructor
+        :return: StreamingInspector of the table
+        """
+        return cls(db.iter_table(table, chunksize=chunksize), **kwargs)
+
+
+    def update(self, chunk:pd.DataFrame):
+        """
+        add a chunk to the sketches. Call make_an_inspection afterwards.
+
+        :param chunk: DataFrame
+        """
+        if self.dtypes is None:
+            self.dtypes = chunk.dtypes.copy()
+            self.count_na = pd.Series(0, index=chunk.columns)
+            for field in chunk.columns:
+                self.hll[field] = HyperLogLog(self.p)
+                self.reservoir[field] = ReservoirSample(1, self.random_state)
+
+        na = chunk.isna()
+        self.count_na += na.sum()
+        self.n_rows += chunk.shape[0]
+
+        for field in chunk.columns:
+            s = chunk[field][~na[field].values]
+            self.hll[field].update(s)
+            self.reservoir[field].update(s)
+
+            if self.dtypes[field] != chunk.dtypes[field]:
+                ## e.g. an integer column with a missing value in a later chunk
+                both_numeric = all(pd.api.types.is_numeric_dtype(t) for t in [self.dtypes[field], chunk.dtypes[field]])
+                self.dtypes[field] = np.result_type(self.dtypes[field], chunk.dtypes[field]) if both_numeric else np.dtype("O")
+
+            if pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s):
+                self._update_numeric(field, s.values.astype(np.float64))
+
+
+    def _update_numeric(self, field:str, values:np.ndarray):
+        if field not in self.kll:
+            self.kll[field] = KLLSketch(self.k, self.random_state)
+            self.moments[field] = [0, 0.0, 0.0, np.inf, -np.inf]
+
+        self.kll[field].update(values)
+
+        if len(values) == 0:
+            return
+
+        ## merge the mean and the sum of squared deviations (Chan et al.)
+        n_a, mean_a, m2_a, min_a, max_a = self.moments[field]
+        n_b, mean_b = len(values), values.mean()
+        m2_b = np.sum((values - mean_b) ** 2)
+        n = n_a + n_b
+        delta = mean_b - mean_a
+
+        self.moments[field] = [n, mean_a + delta * n_b / n,
+                               m2_a + m2_b + delta ** 2 * n_a * n_b / n,
+                               min(min_a, values.min()), max(max_a, values.max())]
+
+
+    def make_an_inspection(self):
+        fields = list(self.hll.keys())
+
+        self.inspection = pd.DataFrame(self.dtypes, columns=["dtype"])
+        self.inspection["count_na"] = self.count_na
+        self.inspection["rate_na"] = self.count_na / self.n_rows
+        self.inspection["n_unique"] = [int(round(self.hll[f].estimate())) for f in fields]
+        self.inspection["n_unique_error"] = [self.hll[f].relative_error() for f in fields]
+        self.inspection["distinct"] = (self.inspection["count_na"] == 0) & \
+            (self.inspection["n_unique"] >= self.n_rows * (1 - 3 * self.inspection["n_unique_error"]))
+        self.m_cats = self._m_cats
+        self.inspection["sample_value"] = [self.reservoir[f].get() for f in fields]
+        return self
+
+
+    def distribution_cons(self, fields:list=None, percentiles:list=None):
+        """
+        return a DataFrame showing the distribution of the continuous variables.
+        The columns are the same as describe() and the quantiles are approximated.
+
+        :param fields: list of continuous fields to check
+        :param percentiles: quantiles to compute (default: [0.25, 0.5, 0.75])
+        :return: DataFrame of distributions
+        """
+        if fields is None:
+            fields = self.get_cons()
+
+        if percentiles is None:
+            percentiles = [0.25, 0.5, 0.75]
+
+        rows = []
+        for field in fields:
+            n, mean, m2, v_min, v_max = self.moments.get(field, [0, np.nan, np.nan, np.nan, np.nan])
+            kll = self.kll.get(field, KLLSketch(self.k))
+
+            row = {"count": n,
+                   "mean": mean if n > 0 else np.nan,
+                   "std": np.sqrt(m2 / (n - 1)) if n > 1 else np.nan,
+                   "min": v_min if n > 0 else np.nan}
+            for q in percentiles:
+                row["%g%%" % (100 * q)] = kll.quantile(q)
+            row["max"] = v_max if n > 0 else np.nan
+            row["rank_error"] = kll.rank_error()
+            rows.append(row)
+
+        return pd.DataFrame(rows, index=fields)
+
+
+class SQLInspector(Inspector):
+
+    def __init__(self, db, table:str, m_cats:int=20, seed:int=None):
+        """
+        Construct an inspection of a table in the database. The statistics
+        are computed by aggregate queries in SQLite, so that the table is
+        not loaded into pandas.
+
+        The dtype is derived from the declared type in the DDL. The methods
+        which need the whole data (significance tests and visualizations)
+        are not available.
+
+        :param db: Database
+        :param table: name of the table
+        :param m_cats: maximum number of values of a categorical variable
+        :param seed: seed for sample_value
+        """
+        self.data = None
+        self.db = db
+        self.table = table
+        self._m_cats = m_cats
+        self.random_state = np.random.RandomState(seed)
+        self.n_rows = None
+        self.inspection = None
+        self.make_an_inspection()
+
+
+    def make_an_inspection(self):
+        schema = self.db.get_schema(self.table)
+        fields = list(schema.keys())
+        cols = [quote_identifier(f) for f in fields]
+
+        ## one scan for all columns
+        exprs = ["COUNT(*)", "MIN(rowid)", "MAX(rowid)"]
+        exprs += ["SUM(%s IS NULL)" % c for c in cols]
+        exprs += ["COUNT(DISTINCT %s)" % c for c in cols]
+        values = self._query_one_row(exprs)
+
+        self.n_rows, min_rowid, max_rowid = values[:3]
+        count_na = pd.Series([v or 0 for v in values[3:3+len(fields)]], index=fields)
+        n_unique = pd.Series(values[3+len(fields):], index=fields)
+
+        def get_dtype(field:str) -> np.dtype:
+            if schema[field] == "INTEGER":
+                return np.dtype("int64") if count_na[field] == 0 else np.dtype("float64")
+            elif schema[field] == "REAL":
+                return np.dtype("float64")
+            else:
+                return np.dtype("O")
+
+        self.inspection = pd.DataFrame({"dtype": [get_dtype(f) for f in fields]}, index=fields)
+        self.inspection["count_na"] = count_na
+        self.inspection["rate_na"] = count_na / self.n_rows if self.n_rows > 0 else np.nan
+        self.inspection["n_unique"] = n_unique
+        self.inspection["distinct"] = self.inspection["n_unique"] == self.n_rows
+        self.m_cats = self._m_cats
+        self.inspection["sample_value"] = [self._sample_value_sql(f, count_na[f], min_rowid, max_rowid)
+                                           for f in fields]
+        return self
+
+
+    def _sample_value_sql(self, field:str, count_na:int, min_rowid:int, max_rowid:int) -> Any:
+        """
+        the first non-missing value after a random rowid (using the rowid index)
+        """
+        if count_na == self.n_rows:
+            return np.nan
+
+        col = quote_identifier(field)
+        rowid = self.random_state.randint(min_rowid, max_rowid + 1)
+        value = self._query_one_row(["%s" % col], where="rowid >= ? AND %s IS NOT NULL ORDER BY rowid LIMIT 1" % col,
+                                    params=[int(rowid)])
+        if value is None:
+            value = self._query_one_row(["%s" % col], where="%s IS NOT NULL ORDER BY rowid LIMIT 1" % col)
+
+        return value[0]
+
+
+    def _query_one_row(self, exprs:list, where:str=None, params=None) -> tuple:
+        """
+        :return: the first row of the query (None if there is no row)
+        """
+        sql = "SELECT %s FROM %s" % (", ".join(exprs), quote_table(self.table))
+        if where is not None:
+            sql += " WHERE %s" % where
+        return self.db.cursor.execute(sql, [] if params is None else params).fetchone()
+
+
+    def distribution_cats(self, fields:list=None, top_k:int=None):
+        """
+        return a DataFrame showing the distribution of the categorical variables.
+        The values are counted by GROUP BY in SQLite.
+
+        :param fields: list of (categorical) fields to check
+        :param top_k: if given, only the top_k most frequent values of each
+                      field are shown in descending order of the count.
+        :return: DataFrame of distributions
+        """
+        if fields is None:
+            fields = self.get_cats()
+
+        df_dist = []
+
+        for field in fields:
+            col = quote_identifier(field)
+            sql = "SELECT %s AS value, COUNT(*) AS count FROM %s GROUP BY %s" % (
+                col, quote_table(self.table), col)
+            if top_k is None:
+                sql += " ORDER BY %s IS NULL, %s" % (col, col)
+            else:
+                sql += " ORDER BY count DESC, %s IS NULL, %s LIMIT ?" % (col, col)
+            df_tmp = self.db.read_query(sql, params=None if top_k is None else [top_k])
+            df_tmp["field"] = field
+            df_tmp.set_index(["field","value"], inplace=True)
+            df_tmp["rate"] = df_tmp["count"]/self.n_rows
+
+            df_dist.append(df_tmp)
+
+        return pd.concat(df_dist, axis=0)
+
+
+    def distribution_cons(self, fields:list=None):
+        """
+        return a DataFrame showing the distribution of the continuous variables.
+        The columns are the same as describe(). The quantiles are interpolated
+        linearly as pandas does.
+
+        :param fields: list of continuous fields to check
+        :return: DataFrame of distributions
+        """
+        if fields is None:
+            fields = self.get_cons()
+
+        if not fields:
+            return pd.DataFrame(columns=["count", "mean", "std", "min", "25%", "50%", "75%", "max"])
+
+        cols = [quote_identifier(f) for f in fields]
+        values = self._query_one_row(["COUNT(%s), AVG(%s), MIN(%s), MAX(%s)" % (c, c, c, c) for c in cols])
+        stats_sql = np.array(values, dtype=np.float64).reshape(len(fields), 4)
+
+        ## the second scan for the exact standard deviation
+        m2 = self._query_one_row(["SUM((%s - ?) * (%s - ?))" % (c, c) for c in cols],
+                                 params=[float(mean) for mean in stats_sql[:,1] for _ in range(2)])
+
+        rows = []
+        for i, field in enumerate(fields):
+            n, mean, v_min, v_max = stats_sql[i]
+            row = {"count": n, "mean": mean,
+                   "std": np.sqrt(m2[i] / (n - 1)) if n > 1 else np.nan,
+                   "min": v_min}
+            for q in [0.25, 0.5, 0.75]:
+                row["%g%%" % (100 * q)] = self._quantile_sql(field, int(n), q)
+            row["max"] = v_max
+            rows.append(row)
+
+        return pd.DataFrame(rows, index=fields)
+
+
+    def _quantile_sql(self, field:str, n:int, q:float) -> float:
+        if n == 0:
+            return np.nan
+
+        col = quote_identifier(field)
+        pos = q * (n - 1)
+        lower = int(np.floor(pos))
+        sql = "SELECT %s FROM %s WHERE %s IS NOT NULL ORDER BY %s LIMIT 2 OFFSET ?" % (
+            col, quote_table(self.table), col, col)
+        values = [row[0] for row in self.db.cursor.execute(sql, [lower]).fetchall()]
+
+        if len(values) == 1:
+            return float(values[0])
+        return values[0] + (pos - lower) * (values[1] - values[0])
+
+
+class OneHotBuilder:
+    def __init__(self, inspector:Inspector, fields:list=None, min_count:int=1,
+                 max_levels:int=None, n_buckets:int=1024):
+        """
+        One-hot encoding of the categorical fields of an Inspector into a sparse
+        CSR matrix. This replaces pd.get_dummies for id-like fields such as
+        customerId or zipCode. The columns of a field are named "field_value"
+        as pd.get_dummies does and the values are sorted, so that the names are
+        stable. NA is encoded as zeros.
+
+        - if min_count > 1, the values which appear less than min_count times
+          and the values unseen in the Inspector are put together into the
+          column "field_other". Otherwise unseen values are encoded as zeros.
+        - a field with more than max_levels distinct values is hashed into
+          n_buckets columns "field_hash0", "field_hash1", ...
+
+            builder = OneHotBuilder(inspector, min_count=5, max_levels=1000)
+            X = builder.transform()
+            model.fit(X, y)
+            show_coefficients(model, builder.feature_names)
+
+        :param inspector: Inspector of the training data
+        :param fields: categorical fields to encode (default: inspector.get_cats())
+        :param min_count: minimum number of rows of a value to get its own column
+        :param max_levels: maximum number of columns of a field without hashing
+                           (default: no hashing)
+        :param n_buckets: number of columns of a hashed field
+        """
+        inspector._require_data("OneHotBuilder")
+        self.inspector = inspector
+        self.fields = inspector.get_cats() if fields is None else list(fields)
+        self.min_count = min_count
+        self.max_levels = max_levels
+        self.n_buckets = n_buckets
+
+        self.categories = {} ## field -> values with own columns (None for hashed fields)
+        self.offsets = {} ## field -> index of the first column
+        self.feature_names = []
+
+        for field in self.fields:
+            codes, uniques = inspector._factorize(field)
+            self.offsets[field] = len(self.feature_names)
+
+            if max_levels is not None and len(uniques) > max_levels:
+                self.categories[field] = None
+                self.feature_names.extend("%s_hash%d" % (field, i) for i in range(n_buckets))
+            else:
+                counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+                self.categories[field] = uniques[counts >= min_count]
+                self.feature_names.extend("%s_%s" % (field, v) for v in self.categories[field])
+                if min_count > 1:
+                    self.feature_names.append("%s_other" % field)
+
+
+    def _columns(self, field:str, s:pd.Series=None) -> np.ndarray:
+        """
+        :return: column index of each row (-1 for NA)
+        """
+        categories = self.categories[field]
+        offset = self.offsets[field]
+
+        if s is None:
+            s = self.inspector.data[field]
+
+        na = pd.isna(s).values
+        columns = np.full(len(s), -1, dtype=np.int64)
+
+        if categories is None:
+            columns[~na] = offset + (hash_values(s[~na]) % np.uint64(self.n_buckets)).astype(np.int64)
+            return columns
+
+        ## get_indexer matches 3.0 with 3 (e.g. an int column read as float because of NA)
+        codes = pd.Index(categories).get_indexer(s).astype(np.int64)
+        columns[codes >= 0] = offset + codes[codes >= 0]
+        if self.min_count > 1:
+            columns[(codes < 0) & ~na] = offset + len(categories)
+        return columns
+
+
+    def transform(self, df:pd.DataFrame=None):
+        """
+        :param df: DataFrame with the fields (default: the data of the Inspector)
+        :return: CSR matrix of shape (number of rows, len(feature_names))
+        """
+        n_rows = self.inspector.data.shape[0] if df is None else df.shape[0]
+
+        rows, cols = [], []
+        for field in self.fields:
+            columns = self._columns(field, None if df is None else df[field])
+            valid = np.flatnonzero(columns >= 0)
+            rows.append(valid)
+            cols.append(columns[valid])
+
+        rows = np.concatenate(rows) if rows else np.array([], dtype=np.int64)
+        cols = np.concatenate(cols) if cols else np.array([], dtype=np.int64)
+
+        return sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)),
+                                 shape=(n_rows, len(self.feature_names)))
@@ -0,0 +1,260 @@
+"""
+Mergeable sketches to profile a column which does not fit in memory.
+Each sketch is updated chunk by chunk and two sketches of the same kind
+can be merged, e.g. sketches built on different parts of a table.
+
+- HyperLogLog: approximate number of distinct values
+- ReservoirSample: uniform random sample of the values
+- KLLSketch: approximate quantiles
+"""
+
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+
+def hash_values(s:pd.Series) -> np.ndarray:
+    """
+    64-bit hash values of the given Series. Equal values have the same hash
+    value across chunks, even if the dtype of a chunk differs, e.g. an integer
+    column is read as float64 in a chunk with a missing value: integral floats
+    are hashed as int64, so 3 and 3.0 have the same hash value.
+
+    :param s: Series (without missing values)
+    :return: array of uint64
+    """
+    if pd.api.types.is_bool_dtype(s) or not pd.api.types.is_numeric_dtype(s):
+        return pd.util.hash_pandas_object(s, index=False).values.astype(np.uint64)
+
+    if pd.api.types.is_integer_dtype(s):
+        return pd.util.hash_array(s.to_numpy(dtype=np.int64))
+
+    values = s.to_numpy(dtype=np.float64)
+    integral = np.isfinite(values) & (values == np.round(values)) & (np.abs(values) < 2.0 ** 63)
+
+    h = np.empty(len(values), dtype=np.uint64)
+    h[integral] = pd.util.hash_array(values[integral].astype(np.int64))
+    h[~integral] = pd.util.hash_array(values[~integral])
+    return h
+
+
+class HyperLogLog:
+    def __init__(self, p:int=14):
+        """
+        HyperLogLog counter of distinct values
+
+        :param p: precision. 2**p registers are used.
+        """
+        if not 4 <= p <= 18:
+            raise ValueError("p must lie in [4,18]")
+
+        self.p = p
+        self.m = 1 << p
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+
+
+    def update(self, s:pd.Series):
+        """
+        add the values (the missing values must be removed in advance)
+
+        :param s: Series of values
+        """
+        if len(s) == 0:
+            return
+
+        h = hash_values(s)
+        idx = (h >> np.uint64(64 - self.p)).astype(np.int64)
+        w = h & np.uint64((1 << (64 - self.p)) - 1)
+
+        ## rank = position of the leftmost 1-bit in the remaining 64-p bits.
+        ## w < 2**50 is exactly representable as float64, so frexp is exact.
+        _, bit_length = np.frexp(w.astype(np.float64))
+        rank = (64 - self.p + 1 - bit_length).astype(np.uint8)
+
+        np.maximum.at(self.registers, idx, rank)
+
+
+    def merge(self, other:"HyperLogLog") -> "HyperLogLog":
+        if self.p != other.p:
+            raise ValueError("HyperLogLogs with different precisions can not be merged")
+
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+
+    def estimate(self) -> float:
+        """
+        :return: estimated number of distinct values
+        """
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        e = alpha * self.m ** 2 / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+
+        n_zeros = np.sum(self.registers == 0)
+        if e <= 2.5 * self.m and n_zeros > 0:
+            ## linear counting for small cardinalities
+            e = self.m * np.log(self.m / n_zeros)
+
+        return float(e)
+
+
+    def relative_error(self) -> float:
+        """
+        :return: relative standard error of the estimate
+        """
+        return 1.04 / np.sqrt(self.m)
+
+
+class ReservoirSample:
+    def __init__(self, k:int=1, random_state:np.random.RandomState=None):
+        """
+        uniform random sample of k values of a stream (Algorithm R)
+
+        :param k: size of the sample
+        :param random_state: RandomState (default: a new one)
+        """
+        self.k = k
+        self.n = 0 ## number of values seen
+        self.sample = []
+        self.random_state = np.random.RandomState() if random_state is None else random_state
+
+
+    def update(self, s:pd.Series):
+        """
+        add the values (the missing values must be removed in advance)
+
+        :param s: Series of values
+        """
+        values = s.values
+        n_fill = min(self.k - len(self.sample), len(values))
+        self.sample.extend(values[:n_fill])
+
+        if n_fill < len(values):
+            ## the i-th value of the stream replaces a random slot with probability k/(i+1)
+            positions = np.arange(self.n + n_fill, self.n + len(values))
+            slots = np.floor(self.random_state.random_sample(len(positions)) * (positions + 1)).astype(np.int64)
+            for i in np.flatnonzero(slots < self.k):
+                self.sample[slots[i]] = values[n_fill + i]
+
+        self.n += len(values)
+
+
+    def merge(self, other:"ReservoirSample") -> "ReservoirSample":
+        """
+        Each slot is taken from the sample of self or other with probability
+        proportional to the number of values they have seen.
+        """
+        mine, theirs = list(self.sample), list(other.sample)
+        n_mine, n_theirs = self.n, other.n
+        sample = []
+
+        while len(sample) < self.k and (mine or theirs):
+            if theirs and (not mine or self.random_state.random_sample() * (n_mine + n_theirs) >= n_mine):
+                sample.append(theirs.pop(self.random_state.randint(len(theirs))))
+                n_theirs -= 1
+            else:
+                sample.append(mine.pop(self.random_state.randint(len(mine))))
+                n_mine -= 1
+
+        self.sample = sample
+        self.n += other.n
+        return self
+
+
+    def get(self) -> Any:
+        """
+        :return: a random value of the stream or NaN if no value is seen
+        """
+        return self.sample[0] if self.sample else np.nan
+
+
+class KLLSketch:
+    def __init__(self, k:int=200, random_state:np.random.RandomState=None):
+        """
+        KLL quantile sketch (Karnin, Lang and Liberty, 2016). The sketch keeps
+        O(k) values. A compactor at level h holds values of weight 2**h. Its
+        capacity decreases geometrically (factor 2/3) towards the lower levels.
+
+        :param k: capacity of the top compactor. A larger value is more accurate.
+        :param random_state: RandomState (default: a new one)
+        """
+        self.k = k
+        self.n = 0
+        self.compactors = [np.array([], dtype=np.float64)]
+        self.random_state = np.random.RandomState() if random_state is None else random_state
+
+
+    def _capacity(self, level:int) -> int:
+        depth = len(self.compactors) - level - 1
+        return max(2, int(np.ceil(self.k * (2/3) ** depth)))
+
+
+    def _compress(self):
+        while sum(len(c) for c in self.compactors) > sum(self._capacity(h) for h in range(len(self.compactors))):
+            for h, compactor in enumerate(self.compactors):
+                if len(compactor) > self._capacity(h):
+                    break
+
+            if h + 1 == len(self.compactors):
+                self.compactors.append(np.array([], dtype=np.float64))
+
+            ## keep every other value (with a random offset) and double its weight
+            compactor = np.sort(self.compactors[h])
+            n_odd = len(compactor) % 2
+            offset = self.random_state.randint(2)
+            promoted = compactor[n_odd:][offset::2]
+
+            self.compactors[h] = compactor[:n_odd]
+            self.compactors[h+1] = np.concatenate([self.compactors[h+1], promoted])
+
+
+    def update(self, values:np.ndarray):
+        """
+        add the values (the missing values must be removed in advance)
+
+        :param values: numerical values
+        """
+        values = np.asarray(values, dtype=np.float64)
+        self.n += len(values)
+
+        self.compactors[0] = np.concatenate([self.compactors[0], values])
+        self._compress()
+
+
+    def merge(self, other:"KLLSketch") -> "KLLSketch":
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append(np.array([], dtype=np.float64))
+
+        for h, compactor in enumerate(other.compactors):
+            self.compactors[h] = np.concatenate([self.compactors[h], compactor])
+
+        self.n += other.n
+        self._compress()
+        return self
+
+
+    def quantile(self, q:float) -> float:
+        """
+        :param q: a number in [0,1]
+        :return: approximate q-quantile or NaN if no value is seen
+        """
+        if self.n == 0:
+            return np.nan
+
+        values = np.concatenate(self.compactors)
+        weights = np.concatenate([np.full(len(c), 2.0 ** h) for h, c in enumerate(self.compactors)])
+
+        order = np.argsort(values, kind="mergesort")
+        cum_weights = np.cumsum(weights[order])
+        i = np.searchsorted(cum_weights, q * cum_weights[-1], side="left")
+        return float(values[order][min(i, len(values) - 1)])
+
+
+    def rank_error(self) -> float:
+        """
+        normalized rank error which holds with probability 99%.
+        This is the empirical bound of KLL used by Apache DataSketches.
+
+        :return: error of the rank of a quantile divided by the number of values
+        """
+        return 2.296 / self.k ** 0.9723
@@ -0,0 +1,16 @@
+-- 
+-- Secondary indexes on the foreign keys and the date columns.
+-- They are created after the bulk load, because maintaining them
+-- during the insert is slower than building them at once.
+-- 
+
+CREATE INDEX IF NOT EXISTS idx_orders_customer_date ON Orders(customerId, orderDate);
+
+CREATE INDEX IF NOT EXISTS idx_orders_campaign ON Orders(campaignId);
+
+CREATE INDEX IF NOT EXISTS idx_orders_date ON Orders(orderDate);
+
+CREATE INDEX IF NOT EXISTS idx_orderlines_order_product ON Orderlines(orderId, productId);
+
+CREATE INDEX IF NOT EXISTS idx_orderlines_product ON Orderlines(productId);
+
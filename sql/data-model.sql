@@ -81,4 +81,17 @@ CREATE TABLE IF NOT EXISTS Orderlines(
   FOREIGN KEY (productId) REFERENCES Products(productId)
 );
 
+-- 
+-- MD5 checksums (from data/*.txt.dvc) of the loaded CSV files.
+-- Used by the incremental load to skip unchanged tables.
+-- 
+
+DROP TABLE IF EXISTS LoadState;
+
+CREATE TABLE IF NOT EXISTS LoadState(
+  tableName TEXT PRIMARY KEY,
+  md5       TEXT,
+  loadedAt  DATETIME
+);
+
 
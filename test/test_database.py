@@ -2,13 +2,25 @@
 test for database.py
 """
 
-from unittest import TestCase
+import asyncio
+import sqlite3
+import threading
+from time import time
+from unittest import TestCase, skipIf, mock
 from datetime import datetime
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import pandas as pd
 
-from lib.database import Database
+from lib.database import Database, AsyncDatabase
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
 
 class TestDatabase(TestCase):
     def test_database(self):
@@ -32,7 +44,391 @@ class TestDatabase(TestCase):
             df = db.read_table("Test")
             self.assertTrue(isinstance(df,pd.DataFrame))
             self.assertEqual(df.shape, (11,3))
-            self.assertEqual(df.dtypes[0], "int64")
-            self.assertEqual(df.dtypes[1], "object")
-            self.assertEqual(df.dtypes[2], "float64")
+            self.assertEqual(df.dtypes.iloc[0], "int64")
+            self.assertTrue(pd.api.types.is_string_dtype(df.dtypes.iloc[1]))
+            self.assertEqual(df.dtypes.iloc[2], "float64")
+
+
+
+    def test_insert_csv(self):
+        df_data = pd.DataFrame({"itemID": range(25)})
+        df_data["insert_ts"] = "2019-01-01 00:00:00"
+        df_data["random"] = np.random.uniform(0,10,size=25)
+
+        with TemporaryDirectory() as tmp_dir:
+            csv_path = Path(tmp_dir).joinpath("test.txt")
+            df_data.to_csv(csv_path, sep="\t", index=False)
+
+            with Database(sql_path="test/test_ddl.sql") as db:
+                db.initialize_db()
+                n_rows = db.insert_csv(csv_path, "Test", chunksize=10,
+                                       read_csv_kwargs=dict(sep="\t"))
+
+                self.assertEqual(n_rows, 25)
+                self.assertEqual(db.read_table("Test").shape, (25,3))
+
+
+    def test_bulk_insert(self):
+        with Database(sql_path="test/test_ddl.sql") as db:
+            db.initialize_db()
+
+            df_data = pd.DataFrame({"itemID": range(11)})
+            df_data["insert_ts"] = pd.Timestamp("2019-01-01 12:34:56")
+            df_data["random"] = np.random.uniform(0,10,size=11)
+            df_data.loc[3, "random"] = np.nan
+
+            synchronous = db.cursor.execute("PRAGMA synchronous").fetchone()[0]
+            db.insert_data(df_data, "Test", bulk=True)
+
+            ## PRAGMAs are restored
+            self.assertEqual(db.cursor.execute("PRAGMA synchronous").fetchone()[0], synchronous)
+
+            df = db.read_table("Test")
+            self.assertEqual(df.shape, (11,3))
+            self.assertEqual(df.loc[0, "insert_ts"], "2019-01-01 12:34:56")
+            self.assertTrue(pd.isna(df.loc[3, "random"]))
+            self.assertAlmostEqual(df.loc[5, "random"], df_data.loc[5, "random"])
+
+            ## a failure rolls back the whole DataFrame
+            with self.assertRaises(sqlite3.IntegrityError):
+                db.insert_data(df_data, "Test", bulk=True)
+            self.assertEqual(db.read_table("Test").shape, (11,3))
+
+
+    def test_bulk_insert_object_column(self):
+        with Database(sql_path="test/test_ddl.sql") as db:
+            db.initialize_db()
+
+            df_data = pd.DataFrame({"itemID": range(4),
+                                    "insert_ts": pd.Series(["2019-01-01 00:00:00", None,
+                                                            "2019-01-03 00:00:00", None], dtype=object),
+                                    "random": [0.5, 1.5, 2.5, 3.5]})
+            df_copy = df_data.copy()
+            db.insert_data(df_data, "Test", bulk=True)
+
+            ## the given DataFrame is not modified
+            self.assertTrue(df_data.equals(df_copy))
+
+            df = db.read_table("Test")
+            self.assertEqual(df.loc[0, "insert_ts"], "2019-01-01 00:00:00")
+            self.assertTrue(pd.isna(df.loc[1, "insert_ts"]))
+
+
+    def test_upsert(self):
+        with Database(sql_path="test/test_ddl.sql") as db:
+            db.initialize_db()
+            self.assertEqual(db.get_primary_key("Test"), ["itemId"])
+
+            df_data = pd.DataFrame({"itemID": range(5), "random": np.arange(5.0)})
+            db.insert_data(df_data, "Test", bulk=True)
+
+            ## 2 rows are changed and 2 rows are new
+            df_data = pd.DataFrame({"itemID": range(2,7), "random": np.arange(2.0,7.0)})
+            df_data.loc[0:1, "random"] = -1.0
+            statements = []
+            db.connection.set_trace_callback(statements.append)
+            db.insert_data(df_data, "Test", upsert=True)
+            db.connection.set_trace_callback(None)
+
+            ## the key itemId is not updated, even though the column is itemID
+            upsert = [sql for sql in statements if "ON CONFLICT" in sql][0]
+            self.assertNotIn('"itemID" = excluded', upsert)
+            self.assertIn('"random" = excluded."random"', upsert)
+
+            df = db.read_table("Test").set_index("itemId")
+            self.assertEqual(df.shape[0], 7)
+            self.assertEqual(list(df["random"]), [0.0, 1.0, -1.0, -1.0, 4.0, 5.0, 6.0])
+            self.assertEqual(db.connection.total_changes, 5 + 4)
+
+            ## initialize_db without drop keeps the rows
+            db.initialize_db(drop=False)
+            self.assertEqual(db.read_table("Test").shape[0], 7)
+
+
+    def test_iter_table(self):
+        with Database(sql_path="test/test_ddl.sql") as db:
+            db.initialize_db()
+
+            df_data = pd.DataFrame({"itemID": range(25)})
+            df_data["insert_ts"] = "2019-01-01 00:00:00"
+            df_data["random"] = np.random.uniform(0,10,size=25)
+            db.insert_data(df_data, "Test", bulk=True)
+
+            chunks = list(db.iter_table("Test", chunksize=10, columns=["itemId", "insert_ts"],
+                                        where="itemId >= ?", params=[3],
+                                        is_datetime=lambda col: col.endswith("_ts")))
+
+            self.assertEqual([df.shape for df in chunks], [(10,2), (10,2), (2,2)])
+            self.assertEqual(list(chunks[0].columns), ["itemId", "insert_ts"])
+            self.assertEqual(chunks[0]["itemId"].min(), 3)
+            self.assertTrue(all(str(df.dtypes["insert_ts"]).startswith("datetime64") for df in chunks))
+
+
+    def test_create_indexes(self):
+        with Database(sql_path="sql/data-model.sql") as db:
+            db.initialize_db()
+            query = """SELECT o.orderDate, ol.productId
+                       FROM Orders o JOIN Orderlines ol ON o.orderId = ol.orderId
+                       WHERE o.customerId = 3"""
+
+            df_plan = db.explain_query(query)
+            self.assertTrue(isinstance(df_plan, pd.DataFrame))
+            self.assertTrue("detail" in df_plan.columns)
+
+            db.create_indexes("sql/data-indexes.sql")
+            detail = " ".join(db.explain_query(query)["detail"])
+
+            self.assertTrue("idx_orders_customer_date" in detail)
+            self.assertTrue("idx_orderlines_order_product" in detail)
+            self.assertFalse("SCAN" in detail)
+
+
+    @skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_cache(self):
+        with TemporaryDirectory() as tmp_dir:
+            db_path = Path(tmp_dir).joinpath("test.sqlite")
+            cache_dir = Path(tmp_dir).joinpath("cache")
+
+            with Database(db_path, sql_path="test/test_ddl.sql", cache_dir=cache_dir) as db:
+                db.initialize_db()
+
+                df_data = pd.DataFrame({"itemID": range(11), "random": np.arange(11.0)})
+                db.insert_data(df_data, "Test", bulk=True)
+
+                df1 = db.read_table("Test")
+                self.assertEqual(len(list(cache_dir.glob("test.sqlite-*.Test.*.feather"))), 1)
+
+                df2 = db.read_table("Test")
+                self.assertTrue(df1.equals(df2))
+
+                ## a modification of the database invalidates the cache
+                db.insert_data(pd.DataFrame({"itemID": [11], "random": [11.0]}), "Test", bulk=True)
+                self.assertEqual(db.read_table("Test").shape[0], 12)
+                self.assertEqual(len(list(cache_dir.glob("test.sqlite-*.Test.*.feather"))), 1)
+
+                ## another database sharing the cache directory
+                other_path = Path(tmp_dir).joinpath("other", "test.sqlite")
+                other_path.parent.mkdir()
+                with Database(other_path, sql_path="test/test_ddl.sql", cache_dir=cache_dir) as other:
+                    other.initialize_db()
+                    self.assertEqual(other.read_table("Test").shape[0], 0)
+                    self.assertEqual(len(list(cache_dir.glob("*.feather"))), 2)
+
+                    db.clear_cache()
+                    self.assertEqual(len(list(cache_dir.glob("*.feather"))), 1)
+                    self.assertEqual(db.read_table("Test").shape[0], 12)
+                    self.assertEqual(other.read_table("Test").shape[0], 0)
+
+
+    def test_typed_read(self):
+        with Database(sql_path="sql/data-model.sql") as db:
+            db.initialize_db()
+            self.assertEqual(db.get_schema("Orders")["orderDate"], "DATETIME")
+
+            n = 100
+            df_orders = pd.DataFrame({"orderId": range(n),
+                                      "customerId": np.arange(n) % 7,
+                                      "orderDate": "2019-01-02 03:04:05",
+                                      "state": np.where(np.arange(n) % 2, "NY", "CA"),
+                                      "city": ["city%d" % i for i in range(n)],
+                                      "totalPrice": np.random.uniform(0,10,size=n)})
+            db.insert_data(df_orders, "Orders", bulk=True)
+
+            df_raw = db.read_table("Orders")
+            df = db.read_table("Orders", typed=True)
+
+            self.assertEqual(df.shape, df_raw.shape)
+            self.assertTrue(str(df.dtypes["orderDate"]).startswith("datetime64"))
+            self.assertEqual(df.loc[0, "orderDate"], pd.Timestamp("2019-01-02 03:04:05"))
+            self.assertEqual(str(df.dtypes["state"]), "category")
+            self.assertNotEqual(str(df.dtypes["city"]), "category") ## high cardinality
+            self.assertEqual(str(df.dtypes["orderId"]), "int8")
+            self.assertEqual(str(df.dtypes["totalPrice"]), "float64")
+            self.assertTrue(df.memory_usage(deep=True).sum() < df_raw.memory_usage(deep=True).sum())
+
+
+    def test_connection_pool(self):
+        n = 1000
+        df_data = pd.DataFrame({"itemID": range(n),
+                                "insert_ts": "2019-01-01 00:00:00",
+                                "random": np.random.uniform(0,10,size=n)})
+
+        with TemporaryDirectory() as tmp_dir:
+            db_path = Path(tmp_dir).joinpath("test.sqlite")
+
+            ## the journal mode is changed only on request
+            with Database(db_path=db_path, sql_path="test/test_ddl.sql", pool_size=2) as db:
+                db.initialize_db()
+                self.assertEqual(db.cursor.execute("PRAGMA journal_mode").fetchone()[0], "delete")
+
+            with Database(db_path=db_path, sql_path="test/test_ddl.sql", pool_size=2, wal=True) as db:
+                db.initialize_db()
+                db.insert_data(df_data, "Test", bulk=True)
+
+                ## parallel reads from worker threads
+                sql = "SELECT SUM(random) AS s FROM Test WHERE itemID < %d"
+                with ThreadPoolExecutor(4) as executor:
+                    results = list(executor.map(lambda i: db.read_query(sql % i).loc[0, "s"],
+                                                range(100, n, 100)))
+                expected = [df_data["random"].iloc[:i].sum() for i in range(100, n, 100)]
+                self.assertTrue(np.allclose(results, expected))
+                self.assertLessEqual(db.pool._n_connections, 2)
+
+                ## the pooled connections are read-only
+                with db.reader() as connection:
+                    with self.assertRaises(sqlite3.OperationalError):
+                        connection.execute("DELETE FROM Test")
+
+                ## the writer is not blocked by an open reader
+                chunks = db.iter_table("Test", chunksize=100)
+                next(chunks)
+                db.cursor.execute("DELETE FROM Test WHERE itemID >= 500")
+                db.connection.commit()
+                self.assertEqual(sum(df.shape[0] for df in chunks), n - 100)
+                self.assertEqual(db.read_query("SELECT COUNT(*) AS n FROM Test").loc[0, "n"], 500)
+
+        with self.assertRaises(ValueError):
+            Database(pool_size=2)
+        with self.assertRaises(ValueError):
+            Database(wal=True)
+
+
+    def test_async_database(self):
+        n = 1000
+        df_data = pd.DataFrame({"itemID": range(n),
+                                "insert_ts": "2019-01-01 00:00:00",
+                                "random": np.random.uniform(0,10,size=n)})
+        slow_query = """WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x+1 FROM c WHERE x < 1000000000)
+                        SELECT SUM(x) AS s FROM c"""
+
+        async def run(db_path:Path):
+            async with AsyncDatabase(db_path, max_workers=2) as adb:
+                df = await adb.read_query("SELECT * FROM Test WHERE itemID < ?", params=[10])
+                self.assertEqual(df.shape, (10, 3))
+
+                df = await adb.read_table("Test", typed=True)
+                self.assertTrue(str(df.dtypes["insert_ts"]).startswith("datetime64"))
+
+                chunks = [df async for df in adb.iter_query("SELECT * FROM Test", chunksize=300)]
+                self.assertEqual([df.shape[0] for df in chunks], [300, 300, 300, 100])
+
+                ## cancellation interrupts the running statement
+                start = time()
+                with self.assertRaises(asyncio.TimeoutError):
+                    await asyncio.wait_for(adb.read_query(slow_query), 0.2)
+
+                ## more calls than workers
+                dfs = await asyncio.gather(*[adb.read_query("SELECT COUNT(*) AS n FROM Test")
+                                             for _ in range(10)])
+                self.assertEqual([df.loc[0, "n"] for df in dfs], [n] * 10)
+
+            self.assertLess(time() - start, 10)
+
+        with TemporaryDirectory() as tmp_dir:
+            db_path = Path(tmp_dir).joinpath("test.sqlite")
+
+            with Database(db_path=db_path, sql_path="test/test_ddl.sql") as db:
+                db.initialize_db()
+                db.insert_data(df_data, "Test", bulk=True)
+
+            asyncio.run(run(db_path))
+
+
+    def test_async_close(self):
+        medium_query = """WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x+1 FROM c WHERE x < 2000000)
+                          SELECT SUM(x) AS s FROM c"""
+
+        async def run(db_path:Path):
+            adb = AsyncDatabase(db_path, max_workers=2)
+            task = asyncio.ensure_future(adb.read_query(medium_query))
+            await asyncio.sleep(0.1)
+
+            ## the event loop keeps running while close waits for the query
+            closing = asyncio.ensure_future(adb.close())
+            ticks = 0
+            while not closing.done():
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+            self.assertGreater(ticks, 0)
+            df = await task
+            self.assertEqual(df.loc[0, "s"], 2000000 * 2000001 // 2)
+
+        with TemporaryDirectory() as tmp_dir:
+            db_path = Path(tmp_dir).joinpath("test.sqlite")
+            with Database(db_path=db_path, sql_path="test/test_ddl.sql") as db:
+                db.initialize_db()
+
+            asyncio.run(run(db_path))
+
+
+    def test_async_cancel_queued(self):
+        read_sql = pd.read_sql
+        queries = []
+
+        def spy(query, *args, **kwargs):
+            queries.append(query)
+            return read_sql(query, *args, **kwargs)
+
+        async def run(db_path:Path):
+            async with AsyncDatabase(db_path, max_workers=2) as adb:
+                ## all worker threads are busy
+                release = threading.Event()
+                blockers = [adb.executor.submit(release.wait) for _ in range(2)]
+
+                with self.assertRaises(asyncio.TimeoutError):
+                    await asyncio.wait_for(adb.read_query("SELECT 1 AS queued"), 0.2)
+
+                release.set()
+                for blocker in blockers:
+                    await asyncio.wrap_future(blocker)
+
+                df = await adb.read_query("SELECT 2 AS after")
+                self.assertEqual(df.loc[0, "after"], 2)
+
+        with TemporaryDirectory() as tmp_dir:
+            db_path = Path(tmp_dir).joinpath("test.sqlite")
+            with Database(db_path=db_path, sql_path="test/test_ddl.sql") as db:
+                db.initialize_db()
+
+            with mock.patch.object(pd, "read_sql", spy):
+                asyncio.run(run(db_path))
+
+        ## the cancelled call never started
+        self.assertEqual(queries, ["SELECT 2 AS after"])
+
+
+    def test_parameterized_query(self):
+        with TemporaryDirectory() as tmp_dir:
+            ddl_path = Path(tmp_dir).joinpath("ddl.sql")
+            ddl_path.write_text('CREATE TABLE "Order Lines" (orderId INTEGER, productId INTEGER);')
+
+            with Database(sql_path=ddl_path, cached_statements=16) as db:
+                db.initialize_db()
+                df_data = pd.DataFrame({"orderId": np.arange(100) % 10, "productId": np.arange(100)})
+                db.insert_data(df_data, "Order Lines", bulk=True)
+
+                ## the table name is quoted
+                self.assertEqual(db.read_table("Order Lines").shape, (100, 2))
+
+                sql = 'SELECT * FROM "Order Lines" WHERE orderId = ? ORDER BY productId'
+                for order_id in range(10):
+                    df = db.read_query(sql, params=[order_id])
+                    self.assertEqual(list(df["productId"]), list(range(order_id, 100, 10)))
+
+                df = db.read_query('SELECT COUNT(*) AS n FROM "Order Lines" WHERE orderId < :n',
+                                   params={"n": 3})
+                self.assertEqual(df.loc[0, "n"], 30)
+
+                ## a value is never parsed as SQL
+                df = db.read_query(sql, params=["0 OR 1 = 1"])
+                self.assertEqual(df.shape[0], 0)
 
+                ## a table qualified by the database
+                self.assertEqual(db.read_table("main.Order Lines").shape, (100, 2))
+                db.cursor.execute("ATTACH DATABASE ':memory:' AS other")
+                db.cursor.execute("CREATE TABLE other.Items (itemId INTEGER PRIMARY KEY, name TEXT)")
+                db.insert_data(pd.DataFrame({"itemId": [1, 2], "name": ["a", "b"]}), "other.Items", bulk=True)
+                self.assertEqual(db.get_primary_key("other.Items"), ["itemId"])
+                self.assertEqual(list(db.get_schema("other.Items").values()), ["INTEGER", "TEXT"])
+                self.assertEqual(list(db.read_table("other.Items")["name"]), ["a", "b"])
@@ -0,0 +1,52 @@
+"""
+test for the cold start of the modules used by batch jobs
+"""
+
+import sys
+import subprocess
+from unittest import TestCase
+
+## seconds to import a module in a new interpreter (including numpy and pandas).
+## Both modules took about 0.6s (as much as numpy and pandas alone) when the
+## budget was set, so a module imported eagerly again exceeds it.
+IMPORT_BUDGET = 1.5
+
+## never imported before a plot is drawn or a notebook is used
+PLOTTING_MODULES = ["matplotlib", "seaborn", "pylab", "IPython", "pydot"]
+
+SCRIPT = """
+import sys
+from time import perf_counter
+start = perf_counter()
+import %s
+print(perf_counter() - start)
+print(",".join(sys.modules.keys()))
+"""
+
+
+def import_in_subprocess(module:str) -> tuple:
+    """
+    :param module: name of the module to import
+    :return: seconds to import the module, set of the loaded modules
+    """
+    output = subprocess.run([sys.executable, "-c", SCRIPT % module],
+                            check=True, capture_output=True, text=True).stdout
+    elapsed, modules = output.strip().split("\n")
+    return float(elapsed), set(modules.split(","))
+
+
+class TestImportTime(TestCase):
+    def test_processing(self):
+        elapsed, modules = import_in_subprocess("lib.processing")
+
+        for module in PLOTTING_MODULES + ["scipy.stats", "scipy.sparse"]:
+            self.assertNotIn(module, modules)
+        self.assertLess(elapsed, IMPORT_BUDGET)
+
+
+    def test_modeling(self):
+        elapsed, modules = import_in_subprocess("lib.modeling")
+
+        for module in PLOTTING_MODULES + ["sklearn", "scipy.stats", "scipy.sparse", "joblib"]:
+            self.assertNotIn(module, modules)
+        self.assertLess(elapsed, IMPORT_BUDGET)
@@ -0,0 +1,131 @@
+"""
+test for loader.py
+"""
+
+import os
+import signal
+from unittest import TestCase
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import pandas as pd
+
+from lib.database import Database
+from lib.loader import read_dependencies, load_order, load_tables
+from lib.loader import read_dvc_md5, read_checksums, update_tables
+
+sql_path = "sql/data-model.sql"
+
+
+def kill_worker(value:str):
+    """
+    converter of read_csv which kills the worker process like the OOM killer
+    """
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+class TestLoader(TestCase):
+    def test_load_order(self):
+        dependencies = read_dependencies(sql_path)
+
+        self.assertEqual(dependencies["Orders"], {"Customers", "Campaigns"})
+        self.assertEqual(dependencies["Orderlines"], {"Orders", "Products"})
+        self.assertEqual(dependencies["Products"], set())
+
+        tables = ["Campaigns", "Customers", "Orderlines", "Orders", "Products"]
+        order = load_order(tables, dependencies)
+
+        self.assertEqual(set(order), set(tables))
+        for table in tables:
+            for parent in dependencies[table]:
+                self.assertTrue(order.index(parent) < order.index(table))
+
+        with self.assertRaises(ValueError):
+            load_order(["A", "B"], {"A": {"B"}, "B": {"A"}})
+
+
+    def test_load_tables(self):
+        df_customers = pd.DataFrame({"customerId": range(30),
+                                     "householdId": range(30),
+                                     "gender": "F",
+                                     "firstName": "Anna"})
+        df_orders = pd.DataFrame({"orderId": range(100),
+                                  "customerId": np.arange(100) % 30,
+                                  "orderDate": "2019-01-01 00:00:00",
+                                  "totalPrice": np.random.uniform(0,10,size=100)})
+
+        with TemporaryDirectory() as tmp_dir:
+            csv_paths = {"Orders": Path(tmp_dir).joinpath("orders.txt"),
+                         "Customers": Path(tmp_dir).joinpath("customers.txt")}
+            df_orders.to_csv(csv_paths["Orders"], sep="\t", index=False)
+            df_customers.to_csv(csv_paths["Customers"], sep="\t", index=False)
+
+            with Database(sql_path=sql_path) as db:
+                db.initialize_db()
+                spill_dir = Path(tmp_dir).joinpath("spill")
+                spill_dir.mkdir()
+                n_rows = load_tables(db, csv_paths, n_jobs=2, chunksize=7, spill_dir=spill_dir,
+                                     read_csv_kwargs=dict(sep="\t"))
+
+                self.assertEqual(n_rows, {"Customers": 30, "Orders": 100})
+                self.assertEqual(list(spill_dir.iterdir()), [])
+                self.assertEqual(db.read_table("Orders").shape[0], 100)
+                self.assertEqual(db.read_table("Customers").shape[0], 30)
+
+
+    def test_load_tables_killed_worker(self):
+        df_customers = pd.DataFrame({"customerId": range(30),
+                                     "householdId": range(30),
+                                     "gender": "F",
+                                     "firstName": "Anna"})
+
+        with TemporaryDirectory() as tmp_dir:
+            csv_paths = {"Customers": Path(tmp_dir).joinpath("customers.txt")}
+            df_customers.to_csv(csv_paths["Customers"], sep="\t", index=False)
+
+            with Database(sql_path=sql_path) as db:
+                db.initialize_db()
+
+                ## the writer does not wait forever for the dead worker
+                with self.assertRaises(BrokenProcessPool):
+                    load_tables(db, csv_paths, n_jobs=1, chunksize=7,
+                                read_csv_kwargs=dict(sep="\t", converters={"gender": kill_worker}))
+
+
+    def test_update_tables(self):
+        self.assertEqual(read_dvc_md5("data/orders.txt.dvc"), "1fb7e7d21510e7eabba400e88cbe183c")
+
+        df_campaigns = pd.DataFrame({"campaignId": range(10), "channel": "MAIL"})
+        df_products = pd.DataFrame({"productId": range(20), "fullPrice": 10})
+
+        with TemporaryDirectory() as tmp_dir:
+            csv_paths = {"Campaigns": Path(tmp_dir).joinpath("campaigns.txt"),
+                         "Products": Path(tmp_dir).joinpath("products.txt")}
+
+            def write(table, df, md5):
+                df.to_csv(csv_paths[table], sep="\t", index=False)
+                with Path(str(csv_paths[table]) + ".dvc").open("w") as dvc_file:
+                    dvc_file.write("md5: 0000\nouts:\n- cache: true\n  md5: %s\n" % md5)
+
+            write("Campaigns", df_campaigns, "aaaa")
+            write("Products", df_products, "bbbb")
+
+            with Database(sql_path=sql_path) as db:
+                db.initialize_db()
+
+                n_rows = update_tables(db, csv_paths, read_csv_kwargs=dict(sep="\t"))
+                self.assertEqual(n_rows, {"Campaigns": 10, "Products": 20})
+                self.assertEqual(read_checksums(db), {"Campaigns": "aaaa", "Products": "bbbb"})
+
+                ## only Products has changed
+                df_products.loc[3, "fullPrice"] = 99
+                write("Products", df_products, "cccc")
+
+                n_rows = update_tables(db, csv_paths, read_csv_kwargs=dict(sep="\t"))
+                self.assertEqual(n_rows, {"Products": 20})
+
+                df = db.read_table("Products").set_index("productId")
+                self.assertEqual(df.shape[0], 20)
+                self.assertEqual(df.loc[3, "fullPrice"], 99)
@@ -1,12 +1,17 @@
 from unittest import TestCase
+from tempfile import TemporaryDirectory
 
-from get_data import *
-from utilipy.modeling import *
+from lib.modeling import *
 
+from scipy import sparse
 from sklearn.datasets import load_iris, load_breast_cancer
-from sklearn.model_selection import GridSearchCV
+from sklearn.model_selection import GridSearchCV, StratifiedKFold
 from sklearn.linear_model import LogisticRegression
 from sklearn.tree import DecisionTreeClassifier
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+from sklearn.pipeline import Pipeline
+from sklearn.base import clone
 
 class ModelingTest(TestCase):
     def test_add_prefix_to_param(self):
@@ -30,12 +35,11 @@ class ModelingTest(TestCase):
         cols = [s[:-5].replace(" ", "_") for s in data.feature_names]
 
         param_grid = { "C": [1,10], "penalty": ["l1","l2"]}
-        model = GridSearchCV(LogisticRegression(),
+        model = GridSearchCV(LogisticRegression(solver="saga", max_iter=5000),
                              param_grid,
                              scoring="accuracy",
                              cv=3,
-                             refit=True,
-                             iid=True)
+                             refit=True)
         model.fit(X,y)
         df = cv_results_summary(model)
 
@@ -57,7 +61,145 @@ class ModelingTest(TestCase):
 
         self.assertTrue(isinstance(s, pd.Series))
         self.assertEqual(set(s.index), set(cols))
-        self.assertTrue(s[0] >= s[len(s)-1])
+        self.assertTrue(s.iloc[0] >= s.iloc[len(s)-1])
+
+
+    def test_multi_transformer(self):
+        np.random.seed(1)
+        n = 200
+        df = pd.DataFrame({"paymentType": np.random.choice(["AE", "DB", "VI"], size=n),
+                           "state": np.random.choice(["CA", "NY"], size=n),
+                           "totalPrice": np.random.uniform(0, 100, size=n)})
+        cats = ["paymentType", "state"]
+
+        model = MultiTransformer(OneHotEncoder(), cats, remainder="passthrough")
+        X = model.fit_transform(df)
+
+        self.assertTrue(sparse.isspmatrix_csr(X))
+        self.assertEqual(X.dtype, np.float32)
+        self.assertEqual(X.shape, (n, 6))
+        self.assertEqual(model.get_feature_names(),
+                         ["paymentType_AE", "paymentType_DB", "paymentType_VI",
+                          "state_CA", "state_NY", "totalPrice"])
+        self.assertTrue(np.allclose(X[:, :5].toarray(), pd.get_dummies(df[cats]).values))
+
+        ## dense output of a transformer class in parallel
+        X = MultiTransformer(StandardScaler, ["totalPrice"], n_jobs=2).fit_transform(df)
+        self.assertTrue(isinstance(X, np.ndarray))
+        self.assertTrue(X.flags.c_contiguous)
+        self.assertAlmostEqual(X.mean(), 0, places=5)
+
+        ## the parameters of the transformer can be tuned in a pipeline
+        pipeline = Pipeline([("onehot", MultiTransformer(OneHotEncoder(), cats)),
+                             ("model", LogisticRegression())])
+        param_grid = add_prefix_to_param("onehot", {"cls__drop": [None, "first"]})
+        grid = GridSearchCV(pipeline, param_grid, cv=3)
+        grid.fit(df, df["totalPrice"] > 50)
+        self.assertEqual(len(grid.cv_results_["params"]), 2)
+
+        ## estimator API without BaseEstimator
+        model = MultiTransformer(OneHotEncoder(drop="first"), cats)
+        self.assertEqual(model.get_params()["cls__drop"], "first")
+        self.assertNotIn("cls__drop", model.get_params(deep=False))
+        cloned = clone(model).set_params(remainder="passthrough", cls__drop=None)
+        self.assertEqual((cloned.remainder, cloned.cls.drop), ("passthrough", None))
+        self.assertEqual(model.cls.drop, "first")
+        with self.assertRaises(ValueError):
+            model.set_params(unknown=1)
+
+
+    def test_cached_grid_search(self):
+        data = load_iris()
+        X, y = data.data, data.target
+
+        param_grid = {"C": [0.1, 1, 10]}
+        grid = GridSearchCV(LogisticRegression(max_iter=1000), param_grid, cv=3,
+                            return_train_score=True)
+        grid.fit(X, y)
+
+        with TemporaryDirectory() as cache_dir:
+            model = CachedGridSearch(LogisticRegression(max_iter=1000), param_grid,
+                                     cache_dir=cache_dir, cv=3, n_jobs=2)
+            model.fit(X, y)
+            self.assertEqual((model.n_fitted_, model.n_cached_), (9, 0))
+            self.assertTrue(np.allclose(model.cv_results_["mean_test_score"],
+                                        grid.cv_results_["mean_test_score"]))
+            self.assertEqual(model.best_params_, grid.best_params_)
+
+            df = cv_results_summary(model)
+            self.assertEqual(df.index.name, "rank_test_score")
+            self.assertEqual(df.shape, (3, 4))
+
+            ## only the new candidate is fitted
+            param_grid["C"].append(100)
+            model = CachedGridSearch(LogisticRegression(max_iter=1000), param_grid,
+                                     cache_dir=cache_dir, cv=3)
+            model.fit(X, y)
+            self.assertEqual((model.n_fitted_, model.n_cached_), (3, 9))
+
+            ## a list of labels as the target
+            y_names = [data.target_names[i] for i in y]
+            model = CachedGridSearch(LogisticRegression(max_iter=1000), param_grid,
+                                     cache_dir=cache_dir, cv=3)
+            model.fit(X, y_names)
+            self.assertEqual(model.n_fitted_, 12)
+            self.assertTrue(np.allclose(model.cv_results_["mean_test_score"][:3],
+                                        grid.cv_results_["mean_test_score"]))
+
+            ## a sparse feature matrix
+            model = CachedGridSearch(LogisticRegression(max_iter=1000), {"C": [1]},
+                                     cache_dir=cache_dir, cv=3)
+            model.fit(sparse.coo_matrix(X), y)
+            self.assertAlmostEqual(model.cv_results_["mean_test_score"][0],
+                                   grid.cv_results_["mean_test_score"][1], places=4)
+
+
+    def test_successive_halving_search(self):
+        data = load_breast_cancer()
+        X, y = data.data, data.target
+
+        param_grid = {"max_leaf_nodes": [3, 6, 12, 24], "min_samples_leaf": [1, 5]}
+        model = SuccessiveHalvingSearch(DecisionTreeClassifier(random_state=0), param_grid,
+                                        factor=2, cv=3, n_jobs=2, random_state=0)
+        model.fit(X, y)
+
+        ## 8 -> 4 -> 2 candidates with growing subsamples
+        self.assertEqual(model.n_candidates_, [8, 4, 2])
+        self.assertEqual(model.n_resources_, sorted(model.n_resources_))
+        self.assertEqual(model.n_resources_[-1], min(len(train) for train, _ in
+                                                     StratifiedKFold(3).split(X, y)))
+
+        df = cv_results_summary(model)
+        self.assertEqual(df.shape, (14, 5))
+        self.assertEqual(list(df.index), list(range(1, 15)))
+        self.assertEqual(model.best_params_, model.cv_results_["params"][model.best_index_])
+        self.assertEqual(model.cv_results_["iter"][model.best_index_], 2)
+
+        ## a list of labels as the target
+        y_names = [data.target_names[i] for i in y]
+        scores = []
+        for target in [y_names, np.array(y_names)]:
+            model_names = SuccessiveHalvingSearch(DecisionTreeClassifier(random_state=0), param_grid,
+                                                  factor=2, cv=3, n_jobs=2, random_state=0)
+            model_names.fit(X, target)
+            scores.append(model_names.cv_results_["mean_test_score"])
+        self.assertTrue(np.allclose(*scores))
+
+        ## number of trees as the resource
+        model = SuccessiveHalvingSearch(RandomForestClassifier(random_state=0), {"max_depth": [3, 5, 8]},
+                                        resource="n_estimators", max_resources=20, factor=2, cv=3)
+        model.fit(X, y)
+        self.assertEqual(model.n_resources_, [10, 20])
+        self.assertEqual(model.best_estimator_.n_estimators, 20)
+
+        ## the resource is taken out of the grid and its largest value is max_resources
+        model = SuccessiveHalvingSearch(RandomForestClassifier(random_state=0), grid_params["RandomForest"],
+                                        resource="n_estimators", cv=3)
+        model.fit(X, y)
+        self.assertEqual(model.n_candidates_, [2])
+        self.assertEqual(model.n_resources_, [max(grid_params["RandomForest"]["n_estimators"])])
+        self.assertTrue(all("n_estimators" not in params for params in model.cv_results_["params"]))
+        self.assertEqual(model.best_estimator_.n_estimators, 50)
 
 
     def test_ROCCurve(self):
@@ -98,7 +240,7 @@ class ModelingTest(TestCase):
 
         self.assertTrue(isinstance(s, pd.Series))
         self.assertEqual(len(s), 6)
-        self.assertEqual(s.dtype, np.float)
+        self.assertEqual(s.dtype, float)
 
         ## A threshold can be larger than 1 if you use an
         ## ordinary regression model. Other values must be
@@ -121,4 +263,10 @@ class ModelingTest(TestCase):
         self.assertTrue(isinstance(df_scores, pd.DataFrame))
         self.assertEqual(df_scores.shape,
                          (len(roc.thresholds), 5) )
-        self.assertEqual(df_scores.index.name, "threshold")
\ No newline at end of file
+        self.assertEqual(df_scores.index.name, "threshold")
+
+        ## the vectorized computation agrees with the threshold-wise one
+        for t in roc.thresholds[::10]:
+            s = roc.get_scores_thru_threshold(t)
+            for metric in df_scores.columns:
+                self.assertAlmostEqual(df_scores.loc[t, metric], s[metric])
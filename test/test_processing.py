@@ -1,22 +1,39 @@
 from unittest import TestCase
+import warnings
 
 import numpy as np
 import pandas as pd
-from sklearn.datasets import load_boston
 
-from lib.processing import Inspector
+from lib.database import Database
+from lib.processing import Inspector, StreamingInspector, SQLInspector, OneHotBuilder
 
 
 def generate_data() -> pd.DataFrame:
     """
-    return a data set for this unit test.
+    return a data set for this unit test. It has the columns of the Boston
+    house prices data set, which was removed from scikit-learn (load_boston).
 
     :return: data set
     """
 
-    bunch = load_boston()
-    df = pd.DataFrame(bunch.data, columns=[c.replace(" ", "_") for c in bunch.feature_names])
-    df["target"] = bunch.target
+    rng = np.random.RandomState(0)
+    n = 506
+    df = pd.DataFrame({
+        "CRIM": rng.exponential(3.6, n).round(2),
+        "ZN": rng.choice(np.arange(0, 100, 4.0), n), ## 25 values
+        "INDUS": rng.uniform(0.5, 27.7, n).round(1),
+        "CHAS": rng.binomial(1, 0.07, n).astype(float),
+        "NOX": rng.uniform(0.38, 0.87, n).round(3),
+        "RM": rng.normal(6.3, 0.7, n).round(2),
+        "AGE": rng.uniform(2.9, 100, n).round(1),
+        "DIS": rng.uniform(1.1, 12.1, n).round(1),
+        "RAD": rng.choice([1, 2, 3, 4, 5, 6, 7, 8, 24], n).astype(float),
+        "TAX": rng.randint(187, 712, n).astype(float),
+        "PTRATIO": rng.choice(np.arange(12.6, 22.1, 0.1).round(1), n),
+        "B": rng.uniform(0.3, 397, n).round(0),
+        "LSTAT": rng.uniform(1.7, 38, n).round(1),
+    })
+    df["target"] = rng.uniform(5, 50, n).round(1)
     df["PTRATIO"] = df["PTRATIO"].apply(str)
     df["TAX"] = np.arange(df.shape[0])
 
@@ -27,7 +44,7 @@ def generate_data() -> pd.DataFrame:
     ncol = df.shape[0]
 
     for col, na_rate in zip(col_chosen, na_rates):
-        mask = np.random.binomial(1, p=na_rate, size=ncol).astype(np.float)
+        mask = np.random.binomial(1, p=na_rate, size=ncol).astype(float)
         mask[mask == 1] = np.nan
         df[col] = df[col] * mask
 
@@ -66,6 +83,331 @@ class ProcessingTest(TestCase):
         self.assertFalse(pd.isna(df_inspection.inspection.loc["RM","sample_value"]))
 
 
+    def test_inspection_in_threads(self):
+        """
+        the inspection with a thread pool is the same as the sequential one
+        """
+        df = generate_data()
+        df_inspection = Inspector(df, m_cats=20)
+        df_threads = Inspector(df, m_cats=20, n_jobs=4)
+
+        cols = ["count_na", "rate_na", "n_unique", "distinct", "variable"]
+        self.assertTrue(df_inspection.inspection[cols].equals(df_threads.inspection[cols]))
+
+        ## a sample value is a value of the column
+        for field in df.columns:
+            value = df_threads.inspection.loc[field, "sample_value"]
+            self.assertTrue(pd.isna(value) or (df[field] == value).any())
+
+
+    def test_streaming_inspection(self):
+        """
+        the sketches agree with the exact inspection within their errors
+        """
+        df = generate_data()
+        chunks = [df.iloc[i:i+100] for i in range(0, df.shape[0], 100)]
+
+        df_inspection = Inspector(df, m_cats=20)
+        df_streaming = StreamingInspector(chunks, m_cats=20, seed=1)
+
+        exact, approx = df_inspection.inspection, df_streaming.inspection
+        self.assertTrue(exact["count_na"].equals(approx["count_na"]))
+
+        for field in df.columns:
+            error = 3 * approx.loc[field, "n_unique_error"] * exact.loc[field, "n_unique"]
+            self.assertTrue(abs(approx.loc[field, "n_unique"] - exact.loc[field, "n_unique"]) <= max(error, 1))
+
+        self.assertEqual(approx.loc["TAX", "distinct"], True)
+        self.assertTrue(pd.isna(approx.loc["CRIM", "sample_value"]))
+
+        df_con = df_streaming.distribution_cons(["target"])
+        s = df["target"]
+        self.assertEqual(df_con.loc["target", "count"], s.count())
+        self.assertAlmostEqual(df_con.loc["target", "mean"], s.mean())
+        self.assertAlmostEqual(df_con.loc["target", "std"], s.std())
+        self.assertTrue(abs((s < df_con.loc["target", "50%"]).mean() - 0.5) <= df_con.loc["target", "rank_error"])
+
+        ## the methods which need the whole data are blocked in the same way
+        calls = [lambda: df_streaming.distribution_cats(),
+                 lambda: df_streaming.significance_test("CHAS", "target"),
+                 lambda: df_streaming.significance_test_features("target"),
+                 lambda: df_streaming.association_matrix(),
+                 lambda: df_streaming.stratified_sample("CHAS", ["target"], 10),
+                 lambda: df_streaming.visualize_two_fields("CHAS", "target")]
+        for call in calls:
+            with self.assertRaisesRegex(NotImplementedError, "StreamingInspector"):
+                call()
+
+
+    def test_streaming_inspection_dtype_drift(self):
+        """
+        an integer column is read as float64 in the chunks with NULL,
+        but the values are counted only once
+        """
+        n = 10000
+        productId = (np.arange(n) % 1000).astype(float)
+        productId[n//2::7] = np.nan
+        df = pd.DataFrame({"orderlineId": np.arange(n), "orderId": np.arange(n) // 3,
+                           "productId": productId})
+
+        with Database(sql_path="sql/data-model.sql") as db:
+            db.initialize_db()
+            db.insert_data(df, "Orderlines", bulk=True)
+
+            df_streaming = StreamingInspector.from_database(db, "Orderlines", chunksize=5000, seed=1)
+            approx = df_streaming.inspection.loc["productId"]
+            self.assertTrue(abs(approx["n_unique"] - 1000) <= 3 * approx["n_unique_error"] * 1000)
+
+
+    def test_sql_inspection(self):
+        """
+        the inspection by SQL is the same as the one by pandas
+        """
+        np.random.seed(3)
+        n = 500
+        df = pd.DataFrame({"productId": np.arange(n),
+                           "productGroupCode": np.random.choice(["A", "B", None], size=n),
+                           "fullPrice": np.random.randint(1, 100, size=n)})
+
+        with Database(sql_path="sql/data-model.sql") as db:
+            db.initialize_db()
+            db.insert_data(df, "Products", bulk=True)
+
+            df_sql = SQLInspector(db, "Products", m_cats=20)
+            df_pandas = Inspector(db.read_table("Products"), m_cats=20)
+
+            cols = ["count_na", "rate_na", "n_unique", "distinct", "variable"]
+            self.assertTrue(df_sql.inspection[cols].equals(df_pandas.inspection[cols]))
+            self.assertTrue(pd.isna(df_sql.inspection.loc["productName", "sample_value"]))
+            self.assertTrue(df_sql.inspection.loc["productGroupCode", "sample_value"] in ["A", "B"])
+
+            dist_sql = df_sql.distribution_cats(["productGroupCode"])
+            dist_pandas = df_pandas.distribution_cats(["productGroupCode"])
+            self.assertEqual(list(dist_sql["count"]), list(dist_pandas["count"]))
+            self.assertEqual(list(dist_sql["rate"]), list(dist_pandas["rate"]))
+
+            dist_sql = df_sql.distribution_cats(["productGroupCode"], top_k=2)
+            dist_pandas = df_pandas.distribution_cats(["productGroupCode"], top_k=2)
+            self.assertEqual(list(dist_sql["count"]), list(dist_pandas["count"]))
+
+            desc_sql = df_sql.distribution_cons(["fullPrice"])
+            desc_pandas = df_pandas.distribution_cons(["fullPrice"])
+            self.assertTrue(np.allclose(desc_sql.values, desc_pandas.values))
+
+
+    def test_significance_test_features(self):
+        """
+        the batched tests agree with significance_test
+        """
+        df = generate_data().dropna(axis=1)
+        df_inspection = Inspector(df, m_cats=20)
+
+        for target in ["target", "CHAS"]:
+            df_pval = df_inspection.significance_test_features(target, n_jobs=2)
+            self.assertEqual(df_pval.shape, (df.shape[1] - 1, 5))
+
+            for _, row in df_pval.iterrows():
+                s = df_inspection.significance_test(row["field1"], target)
+                self.assertEqual(row["test"], s["test"])
+                if pd.isna(s["pval"]):
+                    self.assertTrue(pd.isna(row["pval"]))
+                else:
+                    self.assertAlmostEqual(row["statistic"], s["statistic"])
+                    self.assertAlmostEqual(row["pval"], s["pval"])
+
+
+    def test_association_matrix(self):
+        """
+        the tests of all pairs agree with significance_test
+        """
+        df = generate_data().dropna(axis=1)
+        df_inspection = Inspector(df, m_cats=20)
+
+        df_assoc = df_inspection.association_matrix(block_size=3)
+        n_fields = df.shape[1]
+        self.assertEqual(df_assoc.shape, (n_fields * (n_fields - 1) // 2, 5))
+
+        for _, row in df_assoc.iterrows():
+            s = df_inspection.significance_test(row["field1"], row["field2"])
+            self.assertEqual(row["test"], s["test"])
+            self.assertAlmostEqual(row["statistic"], s["statistic"])
+            self.assertAlmostEqual(row["pval"], s["pval"])
+
+        ## a degenerate pair does not abort the matrix and constant fields are skipped
+        df["rare"] = "a"
+        df.loc[:3, "rare"] = ["b", "b", "c", "c"]
+        df["const"] = 1
+        df_inspection = Inspector(df, m_cats=20)
+        df_assoc = df_inspection.association_matrix(fields=["rare", "const", "target", "CHAS"])
+        self.assertEqual(df_assoc.shape, (3, 5))
+        row = df_assoc[(df_assoc["field1"] == "rare") & (df_assoc["field2"] == "target")].iloc[0]
+        self.assertTrue(pd.isna(row["pval"]))
+
+        with self.assertRaisesRegex(ValueError, "Unknown fields"):
+            df_inspection.association_matrix(fields=["target", "no_such_field"])
+
+
+    def test_distribution_cats(self):
+        """
+        the distribution agrees with value_counts
+        """
+        np.random.seed(4)
+        n = 1000
+        df = pd.DataFrame({"customerId": np.random.randint(0, 300, size=n),
+                           "paymentType": np.random.choice(["AE", "DB", "MC", "VI", None], size=n)})
+        df_inspection = Inspector(df, m_cats=500)
+
+        df_dist = df_inspection.distribution_cats()
+        for field in df.columns:
+            s = df[field].value_counts(dropna=False).sort_index()
+            self.assertEqual(list(df_dist.loc[field, "count"]), list(s))
+            self.assertTrue(np.allclose(df_dist.loc[field, "rate"], s / n))
+
+        self.assertTrue(pd.isna(df_dist.loc["paymentType"].index[-1]))
+
+        df_top = df_inspection.distribution_cats(top_k=3)
+        for field in df.columns:
+            s = df[field].value_counts(dropna=False)
+            self.assertEqual(list(df_top.loc[field, "count"]), list(s.iloc[:3]))
+
+
+    def test_stratified_sample(self):
+        """
+        each category keeps its share in the sample
+        """
+        np.random.seed(5)
+        n = 10000
+        df = pd.DataFrame({"paymentType": np.random.choice(["AE", "DB", "VI"], p=[0.7, 0.299, 0.001], size=n),
+                           "totalPrice": np.random.rand(n)})
+        df_inspection = Inspector(df, m_cats=20)
+
+        df_sample = df_inspection.stratified_sample("paymentType", ["paymentType", "totalPrice"],
+                                                    max_points=100, seed=1)
+        counts = df["paymentType"].value_counts()
+        sample_counts = df_sample["paymentType"].value_counts()
+
+        self.assertTrue(100 <= df_sample.shape[0] <= 100 + len(counts))
+        for value, count in counts.items():
+            self.assertEqual(sample_counts[value], max(np.ceil(100 * count / n), 1))
+        self.assertTrue(df_sample.equals(df.loc[df_sample.index]))
+
+        ## a high-cardinality field: the rare values share one stratum
+        df["customerId"] = np.where(df["paymentType"] == "AE", "frequent",
+                                    ["c%d" % i for i in range(n)])
+        df_inspection = Inspector(df, m_cats=20)
+        df_sample = df_inspection.stratified_sample("customerId", ["customerId"],
+                                                    max_points=100, seed=1)
+        self.assertTrue(100 <= df_sample.shape[0] <= 100 + 10 + 1)
+        self.assertEqual((df_sample["customerId"] == "frequent").sum(),
+                         np.ceil(100 * (df["customerId"] == "frequent").mean()))
+        self.assertTrue(df_sample.equals(df.loc[df_sample.index, ["customerId"]]))
+
+
+    def test_one_hot_builder(self):
+        """
+        the sparse matrix agrees with pd.get_dummies
+        """
+        np.random.seed(6)
+        n = 1000
+        df = pd.DataFrame({"paymentType": np.random.choice(["AE", "DB", "VI", None], size=n),
+                           "campaignId": np.random.choice([1, 2, 3, 4], p=[0.5, 0.3, 0.19, 0.01], size=n),
+                           "customerId": np.random.randint(0, 500, size=n)})
+        df_inspection = Inspector(df, m_cats=1000)
+        for field in df.columns:
+            df_inspection.set_variable_type(field, "categorical")
+
+        fields = ["paymentType", "campaignId"]
+        builder = OneHotBuilder(df_inspection, fields=fields)
+        X = builder.transform()
+        df_dummies = pd.get_dummies(df[fields], columns=fields)
+
+        self.assertEqual(X.format, "csr")
+        self.assertEqual(builder.feature_names, list(df_dummies.columns))
+        self.assertTrue(np.array_equal(X.toarray(), df_dummies.values))
+
+        ## frequency cutoff and hashing
+        builder = OneHotBuilder(df_inspection, min_count=50, max_levels=100, n_buckets=32)
+        X = builder.transform()
+        self.assertEqual(X.shape, (n, 4 + 4 + 32))
+        self.assertIn("campaignId_other", builder.feature_names)
+        self.assertNotIn("campaignId_4", builder.feature_names)
+        self.assertEqual(builder.feature_names[-1], "customerId_hash31")
+        self.assertTrue(np.array_equal(X.sum(axis=1).A1, 3 - df["paymentType"].isna()))
+
+        ## the same columns for new data
+        df_new = pd.DataFrame({"paymentType": ["AE"], "campaignId": [99], "customerId": [0]})
+        X_new = builder.transform(df_new)
+        self.assertEqual(X_new.shape, (1, X.shape[1]))
+        names = [builder.feature_names[i] for i in X_new.indices]
+        self.assertEqual(names[:2], ["paymentType_AE", "campaignId_other"])
+        self.assertTrue(names[2].startswith("customerId_hash"))
+
+        ## integer fields read as float because of NA are encoded in the same way
+        df_float = df.head(6).copy()
+        df_float["campaignId"] = df_float["campaignId"].where(df_float.index < 5)
+        df_float["customerId"] = df_float["customerId"].where(df_float.index < 5)
+        df_float.loc[5, "paymentType"] = "AE"
+        self.assertEqual(df_float["customerId"].dtype, np.float64)
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            X_float = builder.transform(df_float)
+        self.assertTrue(np.array_equal(X_float[:5].toarray(), X[:5].toarray()))
+        self.assertEqual(X_float[5].nnz, 1)
+
+        ## the encoding needs the whole data
+        with self.assertRaisesRegex(NotImplementedError, "OneHotBuilder"):
+            OneHotBuilder(StreamingInspector([df], m_cats=1000))
+
+
+    def test_cache(self):
+        """
+        crosstabs and group partitions are cached and invalidated
+        """
+        df = generate_data().dropna(axis=1)
+        df_inspection = Inspector(df, m_cats=20)
+        df_inspection.set_variable_type("CHAS", "binary")
+        df_inspection.set_variable_type("RAD", "categorical")
+
+        s1 = df_inspection.significance_test("CHAS", "RAD")
+        s2 = df_inspection.significance_test("CHAS", "target")
+        self.assertIn(("crosstab", "CHAS", "RAD"), df_inspection._cache.entries)
+        self.assertIn(("groups", "CHAS", "target"), df_inspection._cache.entries)
+        self.assertTrue(s1.equals(df_inspection.significance_test("CHAS", "RAD")))
+        self.assertTrue(s2.equals(df_inspection.significance_test("CHAS", "target")))
+
+        ## the entries of the reclassified field are removed
+        df_inspection.set_variable_type("RAD", "continuous")
+        self.assertNotIn(("crosstab", "CHAS", "RAD"), df_inspection._cache.entries)
+        self.assertIn(("groups", "CHAS", "target"), df_inspection._cache.entries)
+
+        ## the classification of RAD is recomputed by the setter of m_cats
+        df_inspection.set_variable_type("RAD", "categorical")
+        df_inspection.significance_test("CHAS", "RAD")
+        df_inspection.m_cats = 1
+        self.assertNotIn(("crosstab", "CHAS", "RAD"), df_inspection._cache.entries)
+        self.assertIn(("groups", "CHAS", "target"), df_inspection._cache.entries)
+
+        ## memory bound
+        df_inspection = Inspector(df, m_cats=20, cache_bytes=0)
+        df_inspection.significance_test("CHAS", "target")
+        self.assertEqual(df_inspection._cache.nbytes, 0)
+
+        ## a replaced column is detected
+        df = df.copy()
+        df_inspection = Inspector(df, m_cats=20)
+        s1 = df_inspection.significance_test("CHAS", "target")
+        df["target"] = df["target"].values[::-1]
+        s2 = df_inspection.significance_test("CHAS", "target")
+        self.assertTrue(s2.equals(Inspector(df.copy(), m_cats=20).significance_test("CHAS", "target")))
+        self.assertNotEqual(s1["statistic"], s2["statistic"])
+
+        ## a modification in place needs clear_cache
+        df.loc[df["CHAS"] == 1, "target"] += 100
+        df_inspection.clear_cache()
+        s3 = df_inspection.significance_test("CHAS", "target")
+        self.assertTrue(s3.equals(Inspector(df.copy(), m_cats=20).significance_test("CHAS", "target")))
+
+
     # def test_distribution(self):
     #     """
     #     check DataFrames for distributions